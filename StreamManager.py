@@ -29,11 +29,18 @@ import getopt
 import os
 import sys
 
+from asyncruntime import AsyncRuntime
 from midiclient import MidiClient
 from twitterclient import TwitterClient
 from mastodonclient import MastodonClient
+from metrics import MetricsServer, default_metrics
 from obsclient import OBSClient
+from outbox import Outbox
+from postqueue import PostQueue
+from scheduler import Scheduler
+from sessionrecorder import SessionRecorder
 from traktorclient import TraktorClient
+from workqueue import WorkQueue
 
 
 # -- Classes
@@ -47,12 +54,20 @@ class StreamManager:
         self.obs_client = None
         self.twitter_client = None
         self.traktor_client = None
+        self.post_queues = []
+        self.scheduler = None
+        self.runtime = None
+        self.metrics_server = None
+        self.recorder = None
 
         config_file_path = None
+        rebuild_collection_cache = False
+        use_asyncio = False
+        session_path = None
 
         try:
             # -- Gather the arguments
-            opts, other_arguments = getopt.getopt(args, 'dl:')
+            opts, other_arguments = getopt.getopt(args, 'adl:rs:')
 
             for argument in other_arguments:
                 if config_file_path is not None:
@@ -64,14 +79,21 @@ class StreamManager:
             if len(opts):
                 # -- Iterate over the options and values
                 for opt, arg_val in opts:
-                    if opt == '-d':
+                    if opt == '-a':
+                        use_asyncio = True
+                    elif opt == '-d':
                         MidiClient.print_midi_devices()
                         sys.exit(2)
                     elif opt == '-l':
                         MidiClient.listen_to_midi(arg_val)
+                    elif opt == '-r':
+                        rebuild_collection_cache = True
+                    elif opt == '-s':
+                        session_path = arg_val
 
         except getopt.GetoptError:
-            print('usage: StreamManager.py <-devices> <-listen> config.ini')
+            print('usage: StreamManager.py <-a> (asyncio) <-d> (devices) <-l device> (listen) <-r> (rebuild) '
+                  '<-s session.jsonl> config.ini')
             sys.exit(2)
 
         if config_file_path is None:
@@ -87,28 +109,81 @@ class StreamManager:
         config = configparser.ConfigParser()
         config.read(config_file_path)
 
-        self.midi_client = MidiClient(config['midi'])
+        # -- Metrics are only served if a port is set, and only on localhost unless told otherwise.
+        if config.has_section('metrics'):
+            metrics_port = int(config['metrics'].get('Port', '0'))
+            if metrics_port != 0:
+                self.metrics_server = MetricsServer(metrics_port, config['metrics'].get('Address', '127.0.0.1'))
+
+        # -- In asyncio mode our periodic tasks and work queues all run on one event loop instead of their own threads.
+        if use_asyncio:
+            self.runtime = AsyncRuntime()
+            self.scheduler = self.runtime
+            new_work_queue = self.runtime.new_work_queue
+        else:
+            self.scheduler = Scheduler()
+            new_work_queue = WorkQueue
+
+        # -- Sessions are recorded so that they can be replayed with benchmarks/replay_session.py.
+        if session_path is not None:
+            self.recorder = SessionRecorder(session_path)
+
+        self.midi_client = MidiClient(config['midi'], new_work_queue, recorder=self.recorder)
         self.twitter_client = TwitterClient(config['twitter'], config['posts'])
         self.mastodon_client = MastodonClient(config['mastodon'], config['posts'])
 
-        post_clients = [self.twitter_client, self.mastodon_client]
+        # -- Each social client posts from its own thread so that they post in parallel and never block midi or OBS.
+        outbox = Outbox(config['posts'].get('OutboxFilename', os.path.expanduser('~/.streammanager_outbox.db')))
+        coalescing_window = float(config['posts'].get('TrackPostCoalescingWindow', '5'))
+        self.post_queues = [PostQueue('twitter', self.twitter_client, outbox, coalescing_window),
+                            PostQueue('mastodon', self.mastodon_client, outbox, coalescing_window)]
 
-        self.traktor_client = TraktorClient(config['traktor'], self.midi_client, post_clients)
-        self.obs_client = OBSClient(config['obs'], self.midi_client, post_clients)
+        self.traktor_client = TraktorClient(config['traktor'], self.midi_client, self.post_queues,
+                                            self.scheduler, rebuild_collection_cache, self.recorder, new_work_queue)
+        self.obs_client = OBSClient(config['obs'], self.midi_client, self.post_queues, new_work_queue,
+                                    recorder=self.recorder)
 
     def main(self):
         if self.traktor_client is not None:
             self.traktor_client.update_track_string()
             self.traktor_client.update_track_artwork(False)
-            self.traktor_client.start()
+
+            if self.runtime is None:
+                self.traktor_client.start()
+            else:
+                self.runtime.serve(self.traktor_client.listen())
 
     def shutdown(self):
+        if self.scheduler is not None:
+            self.scheduler.shutdown()
+
+        if self.traktor_client is not None:
+            self.traktor_client.shutdown()
+
         if self.midi_client is not None:
             self.midi_client.shutdown()
 
         if self.obs_client is not None:
             self.obs_client.shutdown()
 
+        if self.recorder is not None:
+            self.recorder.shutdown()
+
+        # -- Give posts that are due, like the stream stop one, a chance to go out. Anything left stays in the outbox.
+        for post_queue in self.post_queues:
+            post_queue.stop()
+
+        for post_queue in self.post_queues:
+            post_queue.wait_until_stopped(10)
+
+        if self.runtime is not None:
+            self.runtime.close()
+
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+
+        default_metrics.print_summary()
+
 
 def main():
     stream_manager = None
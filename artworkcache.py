@@ -0,0 +1,146 @@
+#
+# ArtworkCache
+# Copyright 2021-2022 by Didier Malenfant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+
+from collections import OrderedDict
+from mutagen import File as MutagenFile
+from queue import Queue
+from threading import Event, Lock, Thread
+
+
+# -- Functions
+def read_track_artwork(filename):
+    """Return the artwork embedded in an audio file or None if it doesn't have any."""
+
+    try:
+        # -- Mutagen can automatically detect format and type of tags
+        file = MutagenFile(filename)
+
+        # -- Access APIC frame and grab the image
+        tag = file.tags.get('APIC:', None)
+
+        if tag is not None:
+            return tag.data
+
+        cover_list = file.get('covr', None)
+        if cover_list is not None and len(cover_list):
+            return bytes(cover_list[0])
+    except Exception:
+        pass
+
+    return None
+
+
+# -- Classes
+class ArtworkCache:
+    """Bounded LRU cache of track artwork, keyed by file path and modification time.
+
+    Artwork can be prefetched on a background thread so that it is ready by the time
+    the track goes on air.
+    """
+
+    def __init__(self, max_entries=32, max_bytes=64 * 1024 * 1024):
+        """Initialize an empty cache."""
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.lock = Lock()
+        self.requests = Queue()
+
+        Thread(target=self.process_requests, daemon=True).start()
+
+    @staticmethod
+    def key(filename):
+        try:
+            return (filename, os.stat(filename).st_mtime_ns)
+        except OSError:
+            return None
+
+    def prefetch(self, filename):
+        """Start reading the artwork for filename in the background."""
+
+        if filename is None:
+            return
+
+        key = ArtworkCache.key(filename)
+        if key is None:
+            return
+
+        with self.lock:
+            if key in self.entries or key in self.pending:
+                return
+
+            self.pending[key] = Event()
+
+        self.requests.put(key)
+
+    def get(self, filename):
+        """Return the artwork for filename, waiting for it if it is being prefetched."""
+
+        if filename is None:
+            return None
+
+        key = ArtworkCache.key(filename)
+        if key is None:
+            return None
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+
+            read_done = self.pending.get(key, None)
+
+        if read_done is not None:
+            read_done.wait()
+
+            with self.lock:
+                if key in self.entries:
+                    return self.entries[key]
+
+        artwork = read_track_artwork(filename)
+        self.store(key, artwork)
+
+        return artwork
+
+    def store(self, key, artwork):
+        size = 0 if artwork is None else len(artwork)
+
+        with self.lock:
+            if key not in self.entries and size <= self.max_bytes:
+                self.entries[key] = artwork
+                self.total_bytes += size
+
+                while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                    _, evicted_artwork = self.entries.popitem(last=False)
+                    self.total_bytes -= 0 if evicted_artwork is None else len(evicted_artwork)
+
+            read_done = self.pending.pop(key, None)
+
+        if read_done is not None:
+            read_done.set()
+
+    def process_requests(self):
+        while True:
+            key = self.requests.get()
+
+            self.store(key, read_track_artwork(key[0]))
@@ -0,0 +1,69 @@
+#
+# ArtworkPayload
+# Copyright 2021-2022 by Didier Malenfant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import hashlib
+import magic
+
+# -- Signatures of the image formats we expect to find in track artwork.
+IMAGE_SIGNATURES = [
+    (b'\xff\xd8\xff', 'image/jpeg', '.jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png', '.png'),
+    (b'GIF87a', 'image/gif', '.gif'),
+    (b'GIF89a', 'image/gif', '.gif'),
+    (b'BM', 'image/bmp', '.bmp')
+]
+
+
+# -- Functions
+def identify_image(data):
+    """Return the (mime_type, extension) of an image."""
+
+    for signature, mime_type, extension in IMAGE_SIGNATURES:
+        if data[:len(signature)] == signature:
+            return mime_type, extension
+
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp', '.webp'
+
+    mime_type = magic.from_buffer(bytes(data[:2048]), mime=True)
+    return mime_type, '.' + mime_type.split('/')[-1]
+
+
+# -- Classes
+class ArtworkPayload:
+    """Artwork of the track on air, read and identified once and shared by all the post clients.
+
+    The image is never copied: it is identified and hashed through a memoryview and
+    every client gets the same bytes object, which io.BytesIO shares instead of copying.
+    """
+
+    def __init__(self, data):
+        """Initialize the payload with the image's bytes."""
+
+        self.data = bytes(data)
+        self.view = memoryview(self.data)
+        self.mime_type, self.extension = identify_image(self.view)
+        self.digest = hashlib.sha256(self.view).hexdigest()
+
+    def __len__(self):
+        return len(self.data)
+
+    @staticmethod
+    def from_file(filename):
+        with open(filename, 'rb') as file:
+            return ArtworkPayload(file.read())
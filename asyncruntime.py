@@ -0,0 +1,162 @@
+#
+# AsyncRuntime
+# Copyright 2021-2022 by Didier Malenfant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import asyncio
+
+from concurrent.futures import ThreadPoolExecutor
+from scheduler import ScheduledTask
+from time import monotonic
+from workqueue import QUEUE_LATENCY, WORK_DURATION, WorkQueue
+
+
+# -- Classes
+class AsyncWorkQueue(WorkQueue):
+    """A WorkQueue run by a task on an AsyncRuntime's event loop instead of its own thread.
+
+    Callbacks still run one at a time and in order, on the runtime's executor since most
+    of them block on files, sockets or locks.
+    """
+
+    def __init__(self, runtime, name):
+        """Initialize the queue and add its task to the runtime's loop. This must be called from the loop's thread."""
+
+        self.runtime = runtime
+        self.name = name
+        self.work = asyncio.Queue()
+        self.task = runtime.loop.create_task(self.process_work())
+
+    def put(self, label, callback, *args, queued_time=None):
+        """Queue callback(*args) from any thread. queued_time is when the work arrived, if it was before now."""
+
+        work = (label, callback, args, monotonic() if queued_time is None else queued_time)
+        self.runtime.loop.call_soon_threadsafe(self.work.put_nowait, work)
+
+    async def process_work(self):
+        while True:
+            label, callback, args, queued_time = await self.work.get()
+
+            if callback is None:
+                break
+
+            start_time = monotonic()
+            QUEUE_LATENCY.observe(start_time - queued_time, queue=self.name, work=label)
+
+            try:
+                await self.runtime.run_in_executor(callback, *args)
+            except Exception as e:
+                print(f'Error running {label}: {e}')
+
+            WORK_DURATION.observe(monotonic() - start_time, queue=self.name, work=label)
+
+    def stop(self):
+        """Stop the task once the work already queued is done."""
+
+        self.put(None, None)
+
+    def wait_until_stopped(self, timeout):
+        self.runtime.run_until_done(self.task, timeout)
+
+
+class AsyncRuntime:
+    """Run our periodic tasks and work queues on a single asyncio event loop.
+
+    The loop runs on the main thread. It can stand in for a Scheduler and creates
+    AsyncWorkQueues in place of WorkQueues. Callbacks that can block, and libraries
+    with no asyncio API, are bridged through a small pool of threads shared by everyone.
+    """
+
+    def __init__(self, max_workers=4):
+        """Initialize the runtime and its event loop. The loop only runs once serve() is called."""
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix='runtime')
+        self.periodic_tasks = []
+
+    def new_work_queue(self, name):
+        return AsyncWorkQueue(self, name)
+
+    def call_every(self, period, callback, *args):
+        """Call callback(*args) every period seconds, starting in period seconds, and return the task. This can be called from any thread.
+
+        Periodic callbacks run on the loop itself and must not block.
+        """
+
+        task = ScheduledTask(period, callback, args)
+        self.loop.call_soon_threadsafe(self.start_periodic_task, task, monotonic() + period)
+
+        return task
+
+    def start_periodic_task(self, task, due_time):
+        self.periodic_tasks.append((task, self.loop.create_task(self.run_periodic_task(task, due_time))))
+
+    async def run_periodic_task(self, task, due_time):
+        while True:
+            delay = due_time - monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            if task.cancelled:
+                return
+
+            due_time = task.record_run(due_time, monotonic())
+
+            try:
+                task.callback(*task.args)
+            except Exception as e:
+                print(f'Error running {task.name}: {e}')
+
+    def run_in_executor(self, callback, *args):
+        return self.loop.run_in_executor(self.executor, callback, *args)
+
+    def serve(self, coroutine):
+        """Run the event loop until coroutine returns. KeyboardInterrupt cancels it and is passed on."""
+
+        task = self.loop.create_task(coroutine)
+
+        try:
+            self.loop.run_until_complete(task)
+        except KeyboardInterrupt:
+            task.cancel()
+            self.run_until_done(task, 1)
+            raise
+
+    def run_until_done(self, task, timeout):
+        """Run the loop until task is done or timeout seconds have passed. The loop must not already be running."""
+
+        if self.loop.is_closed() or task.done():
+            return
+
+        self.loop.run_until_complete(asyncio.wait([task], timeout=timeout))
+
+    def shutdown(self, timeout=1):
+        """Stop running periodic tasks, like Scheduler.shutdown()."""
+
+        for task, loop_task in self.periodic_tasks:
+            task.cancel()
+            loop_task.cancel()
+
+        if len(self.periodic_tasks) != 0:
+            self.loop.run_until_complete(asyncio.wait([loop_task for _, loop_task in self.periodic_tasks], timeout=timeout))
+
+    def close(self):
+        """Close the loop once everything using it is shut down."""
+
+        self.executor.shutdown(wait=False)
+        self.loop.close()
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+#
+# BenchmarkCollection
+# Copyright 2021-2022 by Didier Malenfant.
+#
+# Measure how long loading and searching Traktor collections of different sizes takes.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import getopt
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+
+from datetime import datetime, timezone
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generate_collection import generate_collection    # noqa: E402
+from traktorcollection import CollectionCache, CollectionIndex, hash_file, normalize_text, read_collection    # noqa: E402
+
+# -- Results where bigger is better, for everything else smaller is better.
+HIGHER_IS_BETTER = ('lookups_per_second',)
+
+# -- Changes smaller than this are noise.
+REGRESSION_THRESHOLD = 0.1
+
+# -- Text and what it should normalize to, checked before measuring anything since a fast wrong lookup is no use.
+NORMALIZED_TEXTS = [
+    ('Love Machine (Original Mix)', 'love machine original mix'),
+    ('  Café   Déjà-Vu! ', 'cafe deja vu'),
+    ('Deep Night (feat. Ocean Tribe)', 'deep night'),
+    ('Deep Night [Ft. Ocean Tribe] (Dub)', 'deep night dub'),
+    ('Deep Night feat. Ocean Tribe', 'deep night'),
+    ('Ocean Tribe Featuring Echo', 'ocean tribe'),
+    ('Feat of Clay', 'feat of clay'),
+    ('Ft Knox', 'ft knox'),
+    ('The Ft. Lauderdale Sessions', 'the ft lauderdale sessions'),
+    ('The Ft. Lauderdale Sessions ft. Echo', 'the ft lauderdale sessions'),
+    ('!!!', '!!!'),
+    (' ? ? ? ', '? ? ?'),
+    ('', ''),
+]
+
+
+# -- Functions
+def max_rss_bytes():
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # -- macOS reports bytes, Linux reports kilobytes.
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def timed(function, *args):
+    start_time = perf_counter()
+    result = function(*args)
+
+    return result, perf_counter() - start_time
+
+
+def peak_memory(function, *args):
+    """Return how many bytes Python allocated at most while running function(*args)."""
+
+    gc.collect()
+    tracemalloc.start()
+
+    try:
+        result = function(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    del result
+    return peak
+
+
+def check_normalization():
+    """Print every text in NORMALIZED_TEXTS that doesn't normalize as expected and return True if they all do."""
+
+    normalized_as_expected = True
+
+    for text, expected in NORMALIZED_TEXTS:
+        normalized = normalize_text(text)
+
+        if normalized != expected:
+            print(f'\'{text}\' normalizes to \'{normalized}\' instead of \'{expected}\'.')
+            normalized_as_expected = False
+
+    return normalized_as_expected
+
+
+def lookup_queries(tracks, count, seed):
+    """Return lists of (title, artist) queries for each kind of lookup we want to measure."""
+
+    rng = random.Random(seed)
+    samples = [rng.choice(tracks) for _ in range(count)] if len(tracks) != 0 else []
+
+    return {
+        # -- What Traktor sends for a track that is in the collection.
+        'exact': [(title, artist) for title, artist, _ in samples],
+        # -- Same track with different case, spacing and punctuation.
+        'normalized': [(title.upper() + ' !', '  ' + artist.lower()) for title, artist, _ in samples],
+        # -- Same track with an extra word, which only the approximate search can find.
+        'approximate': [(title + ' Edit', artist) for title, artist, _ in samples],
+        # -- Tracks that aren't in the collection made of words that are, the slowest search.
+        'missing': [(f'{rng.choice(tracks)[0]} {rng.choice(tracks)[0]}', rng.choice(tracks)[1]) for _ in range(count)],
+    }
+
+
+def measure_lookups(index, queries):
+    results = {}
+
+    for kind, kind_queries in queries.items():
+        normalize_text.cache_clear()
+
+        hits = 0
+        start_time = perf_counter()
+
+        for title, artist in kind_queries:
+            if index.lookup(title, artist) is not None:
+                hits += 1
+
+        seconds = perf_counter() - start_time
+
+        results[kind] = {
+            'count': len(kind_queries),
+            'seconds': seconds,
+            'lookups_per_second': len(kind_queries) / seconds if seconds > 0 else None,
+            'hit_rate': hits / len(kind_queries) if len(kind_queries) != 0 else None
+        }
+
+    return results
+
+
+def benchmark_collection(collection_path, lookup_count, seed):
+    """Run every measurement on one collection. This runs in its own process so that max_rss_bytes is its own."""
+
+    results = {'nml_bytes': os.path.getsize(collection_path)}
+
+    tracks, results['parse_seconds'] = timed(read_collection, collection_path)
+    results['tracks'] = len(tracks)
+
+    normalize_text.cache_clear()
+    index, results['index_build_seconds'] = timed(CollectionIndex, tracks)
+
+    stat = os.stat(collection_path)
+    content_hash, results['hash_seconds'] = timed(hash_file, collection_path)
+
+    with tempfile.TemporaryDirectory() as cache_folder:
+        cache = CollectionCache(os.path.join(cache_folder, 'collection.db'))
+
+        _, results['cache_save_seconds'] = timed(cache.save, collection_path, tracks, stat, content_hash)
+        _, results['cache_load_seconds'] = timed(cache.load, collection_path)
+
+    track_list = [track for track in tracks.values() if len(track[0]) != 0 and len(track[1]) != 0]
+    results['lookups'] = measure_lookups(index, lookup_queries(track_list, lookup_count, seed))
+
+    del index, tracks, track_list
+
+    results['parse_peak_bytes'] = peak_memory(read_collection, collection_path)
+    results['index_build_peak_bytes'] = peak_memory(CollectionIndex, read_collection(collection_path))
+    results['max_rss_bytes'] = max_rss_bytes()
+
+    return results
+
+
+def flatten(results, prefix=''):
+    values = {}
+
+    for name, value in results.items():
+        if isinstance(value, dict):
+            values.update(flatten(value, f'{prefix}{name}.'))
+        elif isinstance(value, (int, float)):
+            values[prefix + name] = value
+
+    return values
+
+
+def compare_results(results, baseline):
+    """Print how results changed from baseline and return True if anything got noticeably worse."""
+
+    baseline_runs = {run['entries']: flatten(run) for run in baseline.get('runs', [])}
+    regressed = False
+
+    for run in results['runs']:
+        baseline_values = baseline_runs.get(run['entries'], None)
+        if baseline_values is None:
+            continue
+
+        for name, value in flatten(run).items():
+            baseline_value = baseline_values.get(name, None)
+            if not baseline_value or not (name.endswith('_seconds') or name.endswith('_bytes') or name.endswith('_per_second')):
+                continue
+
+            change = (value - baseline_value) / baseline_value
+            if name.endswith(HIGHER_IS_BETTER):
+                change = -change
+
+            if change > REGRESSION_THRESHOLD:
+                regressed = True
+                print(f'{run["entries"]} entries {name}: {baseline_value:.6g} -> {value:.6g} ({change * 100:+.0f}% worse)')
+            elif change < -REGRESSION_THRESHOLD:
+                print(f'{run["entries"]} entries {name}: {baseline_value:.6g} -> {value:.6g} ({-change * 100:.0f}% better)')
+
+    return regressed
+
+
+def source_version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    entry_counts = [1000, 10000, 100000]
+    lookup_count = 10000
+    seed = 1
+    output_path = None
+    baseline_path = None
+
+    try:
+        opts, other_arguments = getopt.getopt(sys.argv[1:], 'n:l:s:o:c:')
+
+        for opt, arg_val in opts:
+            if opt == '-n':
+                entry_counts = [int(count) for count in arg_val.split(',')]
+            elif opt == '-l':
+                lookup_count = int(arg_val)
+            elif opt == '-s':
+                seed = int(arg_val)
+            elif opt == '-o':
+                output_path = arg_val
+            elif opt == '-c':
+                baseline_path = arg_val
+    except (getopt.GetoptError, ValueError):
+        other_arguments = ['']
+
+    if len(other_arguments) != 0:
+        print('usage: benchmark_collection.py <-n entries,entries,...> <-l lookups> <-s seed> <-o results.json> <-c baseline.json>')
+        sys.exit(2)
+
+    if not check_normalization():
+        sys.exit(1)
+
+    results = {
+        'version': source_version(),
+        'date': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': seed,
+        'runs': []
+    }
+
+    # -- Each collection is measured in a new process so that memory use from one doesn't affect the next.
+    context = multiprocessing.get_context('spawn')
+
+    with tempfile.TemporaryDirectory() as folder:
+        for entry_count in entry_counts:
+            collection_path = os.path.join(folder, f'collection_{entry_count}.nml')
+
+            print(f'Generating {entry_count} entries...')
+            generate_collection(collection_path, entry_count, seed)
+
+            print(f'Benchmarking {entry_count} entries...')
+            with context.Pool(1) as pool:
+                run = pool.apply(benchmark_collection, (collection_path, lookup_count, seed))
+
+            os.remove(collection_path)
+
+            run = {'entries': entry_count, **run}
+            results['runs'].append(run)
+
+            lookups = ', '.join(f'{kind} {values["lookups_per_second"]:.0f}/s' for kind, values in run['lookups'].items()
+                                if values['lookups_per_second'] is not None)
+            print(f'  parse {run["parse_seconds"]:.3f}s, peak {run["parse_peak_bytes"] / 1024 / 1024:.1f}MB, '
+                  f'index {run["index_build_seconds"]:.3f}s, cache load {run["cache_load_seconds"]:.3f}s, lookups {lookups}')
+
+    if output_path is None:
+        print(json.dumps(results, indent=2))
+    else:
+        with open(output_path, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if baseline_path is not None:
+        with open(baseline_path) as file:
+            baseline = json.load(file)
+
+        if compare_results(results, baseline):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,477 @@
+#!/usr/bin/env python3
+#
+# FakeOBSServer
+# Copyright 2021-2022 by Didier Malenfant.
+#
+# Stand-in for OBS and its obs-websocket 4.x server, for testing without OBS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import base64
+import getopt
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import random
+import socket
+import socketserver
+import struct
+import sys
+
+from threading import Condition, Lock, Thread
+from time import monotonic, sleep
+
+DEFAULT_SCENES = ['Starting Soon', 'DJ Cam', 'Decks', 'Crowd', 'Be Right Back', 'Ending']
+
+# -- Magic value every websocket server appends to the client's key, from RFC 6455.
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+OPCODE_CONTINUATION = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+# -- How long OBS takes to actually start or stop the stream once asked to.
+STREAM_DELAY = 0.1
+
+
+# -- Functions
+def websocket_accept_key(key):
+    return base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode('ascii')).digest()).decode('ascii')
+
+
+def unmask(payload, mask):
+    # -- XOR the whole payload in one go as an integer, byte by byte would be far too slow for large messages.
+    length = len(payload)
+    repeated_mask = (mask * (length // 4 + 1))[:length]
+
+    return (int.from_bytes(payload, 'big') ^ int.from_bytes(repeated_mask, 'big')).to_bytes(length, 'big')
+
+
+def websocket_frame(opcode, payload):
+    length = len(payload)
+
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+
+    return header + payload
+
+
+def scene_info(name):
+    return {'name': name, 'sources': []}
+
+
+def main():
+    port = 4444
+    scenes = DEFAULT_SCENES
+    transition_duration = 0.3
+    latency = 0.0
+    jitter = 0.0
+    password = None
+
+    try:
+        opts, other_arguments = getopt.getopt(sys.argv[1:], 'p:s:t:l:j:w:')
+
+        for opt, arg_val in opts:
+            if opt == '-p':
+                port = int(arg_val)
+            elif opt == '-s':
+                scenes = arg_val.split(',')
+            elif opt == '-t':
+                transition_duration = float(arg_val)
+            elif opt == '-l':
+                latency = float(arg_val)
+            elif opt == '-j':
+                jitter = float(arg_val)
+            elif opt == '-w':
+                password = arg_val
+    except (getopt.GetoptError, ValueError):
+        other_arguments = ['']
+
+    if len(other_arguments) != 0:
+        print('usage: fake_obs_server.py <-p port> <-s scene,scene,...> <-t transition seconds> <-l latency seconds> '
+              '<-j jitter seconds> <-w password>')
+        sys.exit(2)
+
+    server = FakeOBSServer(port, scenes=scenes, transition_duration=transition_duration, latency=latency,
+                           jitter=jitter, password=password)
+
+    try:
+        while True:
+            sleep(1)
+    except KeyboardInterrupt:
+        pass
+
+    server.shutdown()
+
+
+# -- Classes
+class FakeOBSConnection:
+    """One client connected to a FakeOBSServer."""
+
+    def __init__(self, server, socket):
+        """Initialize the connection for a socket that already did the websocket handshake."""
+
+        self.server = server
+        self.socket = socket
+        self.send_lock = Lock()
+        self.authenticated = server.password is None
+        self.salt = base64.b64encode(os.urandom(16)).decode('ascii')
+        self.challenge = base64.b64encode(os.urandom(16)).decode('ascii')
+
+    def send(self, message, opcode=OPCODE_TEXT):
+        payload = json.dumps(message).encode('utf-8') if opcode == OPCODE_TEXT else message
+
+        with self.send_lock:
+            try:
+                self.socket.sendall(websocket_frame(opcode, payload))
+            except OSError:
+                # -- The client went away, its receive loop will notice.
+                pass
+
+    def receive_messages(self, file):
+        fragments = []
+
+        while True:
+            header = file.read(2)
+            if len(header) < 2:
+                return
+
+            opcode = header[0] & 0x0F
+            is_final = header[0] & 0x80
+            length = header[1] & 0x7F
+
+            if length == 126:
+                length = struct.unpack('!H', file.read(2))[0]
+            elif length == 127:
+                length = struct.unpack('!Q', file.read(8))[0]
+
+            mask = file.read(4) if header[1] & 0x80 else None
+            payload = file.read(length)
+            if len(payload) < length:
+                return
+
+            if mask is not None:
+                payload = unmask(payload, mask)
+
+            if opcode == OPCODE_CLOSE:
+                self.send(payload[:2], OPCODE_CLOSE)
+                return
+            elif opcode == OPCODE_PING:
+                self.send(payload, OPCODE_PONG)
+                continue
+            elif opcode == OPCODE_PONG:
+                continue
+
+            fragments.append(payload)
+            if not is_final:
+                continue
+
+            message = b''.join(fragments)
+            fragments = []
+
+            self.server.handle_request(self, message)
+
+    def authenticate(self, auth):
+        secret = base64.b64encode(hashlib.sha256((self.server.password + self.salt).encode('utf-8')).digest())
+        expected_auth = base64.b64encode(hashlib.sha256(secret + self.challenge.encode('utf-8')).digest()).decode('utf-8')
+
+        self.authenticated = auth == expected_auth
+        return self.authenticated
+
+
+class FakeOBSServer:
+    """Stand-in for OBS that speaks the obs-websocket 4.x protocol, served from background threads.
+
+    It has a list of scenes and a stream that can be started and stopped, answers
+    requests after latency seconds and sends the events OBS would, with scene
+    transitions that take transition_duration seconds. Answers can arrive in a
+    different order than the requests when latency has jitter, like with the real thing.
+    """
+
+    def __init__(self, port=4444, address='127.0.0.1', scenes=DEFAULT_SCENES, transition_duration=0.3, latency=0.0,
+                 jitter=0.0, password=None):
+        """Initialize the server and start serving. By default we only listen on localhost."""
+
+        self.scenes = list(scenes)
+        self.current_scene = self.scenes[0] if len(self.scenes) != 0 else None
+        self.streaming = False
+        self.transition_duration = transition_duration
+        self.latency = latency
+        self.jitter = jitter
+        self.password = password
+        self.lock = Lock()
+        self.connections = set()
+        self.request_count = 0
+
+        # -- Everything that happens later, answers and events, is sent from one thread in the order it is due.
+        self.condition = Condition()
+        self.due_calls = []
+        self.call_ids = itertools.count()
+        self.stopping = False
+        self.sender = Thread(target=self.run_due_calls, daemon=True)
+
+        fake_obs = self
+
+        class WebsocketHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                if not fake_obs.handshake(self.rfile, self.wfile):
+                    return
+
+                self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+                connection = FakeOBSConnection(fake_obs, self.request)
+
+                with fake_obs.lock:
+                    fake_obs.connections.add(connection)
+
+                try:
+                    connection.receive_messages(self.rfile)
+                except OSError:
+                    pass
+                finally:
+                    with fake_obs.lock:
+                        fake_obs.connections.discard(connection)
+
+        self.server = socketserver.ThreadingTCPServer((address, port), WebsocketHandler, bind_and_activate=False)
+        self.server.daemon_threads = True
+        self.server.allow_reuse_address = True
+        self.server.server_bind()
+        self.server.server_activate()
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+
+        self.sender.start()
+        self.thread.start()
+
+        print(f'Fake OBS listening on ws://{address}:{self.port} with {len(self.scenes)} scenes.')
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    @staticmethod
+    def handshake(rfile, wfile):
+        request_line = rfile.readline()
+        headers = {}
+
+        while True:
+            line = rfile.readline().decode('latin-1').strip()
+            if len(line) == 0:
+                break
+
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        key = headers.get('sec-websocket-key', None)
+        if not request_line.startswith(b'GET') or key is None:
+            wfile.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n')
+            return False
+
+        wfile.write(('HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                     f'Sec-WebSocket-Accept: {websocket_accept_key(key)}\r\n\r\n').encode('ascii'))
+        wfile.flush()
+
+        return True
+
+    def call_later(self, delay, callback, *args):
+        with self.condition:
+            heapq.heappush(self.due_calls, (monotonic() + delay, next(self.call_ids), callback, args))
+            self.condition.notify()
+
+    def run_due_calls(self):
+        while True:
+            with self.condition:
+                while not self.stopping:
+                    if len(self.due_calls) != 0:
+                        delay = self.due_calls[0][0] - monotonic()
+                        if delay <= 0:
+                            break
+                    else:
+                        delay = None
+
+                    self.condition.wait(delay)
+
+                if self.stopping:
+                    return
+
+                _, _, callback, args = heapq.heappop(self.due_calls)
+
+            callback(*args)
+
+    def answer_later(self, connection, answer):
+        delay = self.latency
+        if self.jitter > 0:
+            delay = max(0.0, delay + random.uniform(-self.jitter, self.jitter))
+
+        if delay > 0:
+            self.call_later(delay, connection.send, answer)
+        else:
+            connection.send(answer)
+
+    def emit_later(self, delay, name, data=None):
+        # -- Events take as long as answers to get to clients.
+        self.call_later(self.latency + delay, self.emit, name, data)
+
+    def emit(self, name, data=None):
+        """Send the event called name to every client."""
+
+        event = {'update-type': name}
+        if data is not None:
+            event.update(data)
+
+        with self.lock:
+            connections = list(self.connections)
+
+        for connection in connections:
+            connection.send(event)
+
+    def handle_request(self, connection, message):
+        try:
+            request = json.loads(message)
+            message_id = request['message-id']
+        except (ValueError, KeyError, TypeError):
+            # -- obs-websocket ignores what it can't read.
+            return
+
+        with self.lock:
+            self.request_count += 1
+
+        if request.get('request-type') == 'ExecuteBatch':
+            results = []
+            for sub_request in request.get('requests', []):
+                result = self.run_request(connection, sub_request)
+                result['message-id'] = sub_request.get('message-id', '')
+                results.append(result)
+
+            answer = {'status': 'ok', 'results': results}
+        else:
+            answer = self.run_request(connection, request)
+
+        answer['message-id'] = message_id
+        self.answer_later(connection, answer)
+
+    def run_request(self, connection, request):
+        """Do what request asks and return the answer without its message-id."""
+
+        name = request.get('request-type')
+
+        if name == 'GetAuthRequired':
+            if self.password is None:
+                return {'status': 'ok', 'authRequired': False}
+
+            return {'status': 'ok', 'authRequired': True, 'challenge': connection.challenge, 'salt': connection.salt}
+        elif name == 'Authenticate':
+            if connection.authenticate(request.get('auth', '')):
+                return {'status': 'ok'}
+
+            return {'status': 'error', 'error': 'Authentication Failed.'}
+
+        if not connection.authenticated:
+            return {'status': 'error', 'error': 'Not Authenticated'}
+
+        with self.lock:
+            if name == 'GetVersion':
+                return {'status': 'ok', 'version': 1.1, 'obs-websocket-version': '4.9.1', 'obs-studio-version': '27.2.4',
+                        'available-requests': 'GetVersion,GetSceneList,GetCurrentScene,SetCurrentScene,'
+                                              'GetStreamingStatus,StartStreaming,StopStreaming,ExecuteBatch'}
+            elif name == 'GetSceneList':
+                return {'status': 'ok', 'current-scene': self.current_scene,
+                        'scenes': [scene_info(scene) for scene in self.scenes]}
+            elif name == 'GetCurrentScene':
+                return dict(scene_info(self.current_scene), status='ok')
+            elif name == 'SetCurrentScene':
+                scene = request.get('scene-name')
+                if scene not in self.scenes:
+                    return {'status': 'error', 'error': 'requested scene does not exist'}
+
+                self.switch_to_scene(scene)
+                return {'status': 'ok'}
+            elif name == 'GetStreamingStatus':
+                return {'status': 'ok', 'streaming': self.streaming, 'recording': False, 'recording-paused': False,
+                        'preview-only': False}
+            elif name == 'StartStreaming':
+                if self.streaming:
+                    return {'status': 'error', 'error': 'streaming already active'}
+
+                self.streaming = True
+                self.emit_later(0, 'StreamStarting', {'preview-only': False})
+                self.emit_later(STREAM_DELAY, 'StreamStarted')
+                return {'status': 'ok'}
+            elif name == 'StopStreaming':
+                if not self.streaming:
+                    return {'status': 'error', 'error': 'streaming not active'}
+
+                self.streaming = False
+                self.emit_later(0, 'StreamStopping', {'preview-only': False})
+                self.emit_later(STREAM_DELAY, 'StreamStopped')
+                return {'status': 'ok'}
+
+        return {'status': 'error', 'error': 'invalid request type'}
+
+    def switch_to_scene(self, scene):
+        previous_scene = self.current_scene
+        self.current_scene = scene
+
+        # -- Like OBS, the scene switch is announced as the transition begins and the transition ends later.
+        self.emit_later(0, 'SwitchScenes', {'scene-name': scene, 'sources': []})
+
+        if self.transition_duration > 0:
+            transition = {'name': 'Fade', 'type': 'fade_transition', 'duration': int(self.transition_duration * 1000)}
+
+            self.emit_later(0, 'TransitionBegin', dict(transition, **{'from-scene': previous_scene, 'to-scene': scene}))
+            self.emit_later(self.transition_duration, 'TransitionEnd', dict(transition, **{'to-scene': scene}))
+
+    def set_scenes(self, scenes):
+        """Change the list of scenes, like adding or removing one in OBS does."""
+
+        with self.lock:
+            self.scenes = list(scenes)
+            if self.current_scene not in self.scenes:
+                self.current_scene = self.scenes[0] if len(self.scenes) != 0 else None
+
+        self.emit('ScenesChanged', {'scenes': [scene_info(scene) for scene in scenes]})
+
+    def disconnect_clients(self):
+        """Drop every client's connection, like OBS quitting would."""
+
+        with self.lock:
+            connections = list(self.connections)
+
+        for connection in connections:
+            try:
+                connection.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def shutdown(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+
+        self.disconnect_clients()
+
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+#
+# FakeSocialServer
+# Copyright 2021-2022 by Didier Malenfant.
+#
+# Stand-in for the Twitter v1.1 and Mastodon status and media APIs, for testing without posting for real.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import getopt
+import itertools
+import json
+import os
+import random
+import ssl
+import subprocess
+import sys
+
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import sleep, time
+from urllib.parse import parse_qs, urlsplit
+
+
+# -- Functions
+def make_certificate(folder):
+    """Write a self-signed certificate and its key for 127.0.0.1 to folder and return the path of the file holding both.
+
+    tweepy only talks https so the Twitter endpoints need one. This needs the openssl command.
+    """
+
+    path = os.path.join(folder, 'fake_social_server.pem')
+
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '2', '-subj', '/CN=127.0.0.1',
+                    '-addext', 'subjectAltName = IP:127.0.0.1,DNS:localhost', '-keyout', path, '-out', path],
+                   check=True, capture_output=True)
+
+    return path
+
+
+def iso_time(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def main():
+    port = 8080
+    latency = 0.0
+    rate_limit_odds = 0.0
+    error_odds = 0.0
+    certificate = None
+
+    try:
+        opts, other_arguments = getopt.getopt(sys.argv[1:], 'p:l:r:e:c:')
+
+        for opt, arg_val in opts:
+            if opt == '-p':
+                port = int(arg_val)
+            elif opt == '-l':
+                latency = float(arg_val)
+            elif opt == '-r':
+                rate_limit_odds = float(arg_val)
+            elif opt == '-e':
+                error_odds = float(arg_val)
+            elif opt == '-c':
+                certificate = arg_val
+    except (getopt.GetoptError, ValueError):
+        other_arguments = ['']
+
+    if len(other_arguments) != 0:
+        print('usage: fake_social_server.py <-p port> <-l latency seconds> <-r rate limit odds> <-e error odds> '
+              '<-c certificate.pem>')
+        sys.exit(2)
+
+    server = FakeSocialServer(port, latency=latency, rate_limit_odds=rate_limit_odds, error_odds=error_odds,
+                              certificate=certificate)
+
+    try:
+        while True:
+            sleep(1)
+    except KeyboardInterrupt:
+        pass
+
+    server.shutdown()
+    server.print_stats()
+
+
+# -- Classes
+class FakeSocialServer:
+    """Stand-in for the Twitter v1.1 and Mastodon status and media endpoints, served from background threads.
+
+    Every request takes latency seconds, give or take jitter. A rate_limit_odds share
+    of them gets a 429 that resets rate_limit_reset seconds later and an error_odds
+    share a 503, the way each API sends them. Both APIs are served on the same port,
+    over https if certificate is the path of a PEM file with a certificate and its key.
+    """
+
+    def __init__(self, port=0, address='127.0.0.1', latency=0.0, jitter=0.0, rate_limit_odds=0.0, error_odds=0.0,
+                 rate_limit_reset=1.0, certificate=None):
+        """Initialize the server and start serving. By default we only listen on localhost."""
+
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_odds = rate_limit_odds
+        self.error_odds = error_odds
+        self.rate_limit_reset = rate_limit_reset
+        self.lock = Lock()
+        self.ids = itertools.count(1000)
+        self.statuses = []
+        self.stats = {}
+
+        fake_social = self
+
+        class SocialHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                fake_social.handle_request(self)
+
+            def do_POST(self):
+                fake_social.handle_request(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((address, port), SocialHandler)
+        self.server.daemon_threads = True
+        scheme = 'http'
+
+        if certificate is not None:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certificate)
+            self.server.socket = context.wrap_socket(self.server.socket, server_side=True)
+            scheme = 'https'
+
+        self.base_url = f'{scheme}://{address}:{self.port}'
+
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+        print(f'Fake social server listening on {self.base_url}')
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    @property
+    def host(self):
+        """The host to give tweepy, which only takes a host and not a URL."""
+
+        return f'{self.server.server_address[0]}:{self.port}'
+
+    def count(self, endpoint, result):
+        with self.lock:
+            key = f'{endpoint} {result}'
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def handle_request(self, handler):
+        url = urlsplit(handler.path)
+        path = url.path.rstrip('/')
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+
+        # -- We read the whole body so that the connection can be reused, but we only look inside forms.
+        body = handler.rfile.read(int(handler.headers.get('Content-Length', '0')))
+        if handler.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+            params.update({name: values[-1] for name, values in parse_qs(body.decode('utf-8')).items()})
+
+        is_twitter = path.startswith('/1.1/')
+        endpoint = f'{handler.command} {path}'
+
+        delay = self.latency
+        if self.jitter > 0:
+            delay = max(0.0, delay + random.uniform(-self.jitter, self.jitter))
+
+        if delay > 0:
+            sleep(delay)
+
+        now = time()
+        reset_time = now + self.rate_limit_reset
+
+        if path not in ('/1.1/statuses/update.json', '/api/v1/statuses', '/1.1/media/upload.json', '/api/v1/media',
+                        '/api/v2/media', '/api/v1/instance', '/api/v2/instance'):
+            self.count(endpoint, 'not found')
+            self.send(handler, 404, {'errors': [{'code': 34, 'message': 'Sorry, that page does not exist.'}]}
+                      if is_twitter else {'error': 'Record not found'})
+            return
+
+        # -- Only posting fails, so that clients can always start.
+        roll = 1.0 if path.endswith('instance') else random.random()
+
+        if roll < self.rate_limit_odds:
+            self.count(endpoint, 'rate limited')
+
+            if is_twitter:
+                self.send(handler, 429, {'errors': [{'code': 88, 'message': 'Rate limit exceeded'}]},
+                          {'x-rate-limit-limit': '300', 'x-rate-limit-remaining': '0',
+                           'x-rate-limit-reset': str(int(reset_time) + 1)})
+            else:
+                self.send(handler, 429, {'error': 'Too many requests'},
+                          {'X-RateLimit-Limit': '300', 'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': iso_time(reset_time)})
+        elif roll < self.rate_limit_odds + self.error_odds:
+            self.count(endpoint, 'error')
+            self.send(handler, 503, {'errors': [{'code': 130, 'message': 'Over capacity'}]} if is_twitter
+                      else {'error': 'Service Unavailable'})
+        else:
+            self.count(endpoint, 'ok')
+
+            if path.endswith('statuses') or path.endswith('update.json'):
+                answer = self.status(is_twitter, params.get('status', ''),
+                                     params.get('in_reply_to_status_id' if is_twitter else 'in_reply_to_id', None), now)
+            elif path.endswith('instance'):
+                answer = {'uri': self.host, 'title': 'Fake Mastodon', 'version': '4.0.2', 'api_versions': {'mastodon': 1}}
+            else:
+                answer = self.media(is_twitter, len(body))
+
+            if is_twitter:
+                self.send(handler, 200, answer, {'x-rate-limit-limit': '300', 'x-rate-limit-remaining': '299',
+                                                 'x-rate-limit-reset': str(int(now) + 900)})
+            else:
+                self.send(handler, 200, answer, {'X-RateLimit-Limit': '300', 'X-RateLimit-Remaining': '299',
+                                                 'X-RateLimit-Reset': iso_time(now + 300)})
+
+    def status(self, is_twitter, text, in_reply_to, now):
+        status_id = next(self.ids)
+
+        with self.lock:
+            self.statuses.append((status_id, text, in_reply_to))
+
+        if is_twitter:
+            return {'id': status_id, 'id_str': str(status_id), 'text': text, 'in_reply_to_status_id_str': in_reply_to,
+                    'created_at': datetime.fromtimestamp(now, timezone.utc).strftime('%a %b %d %H:%M:%S +0000 %Y')}
+
+        return {'id': str(status_id), 'content': f'<p>{text}</p>', 'in_reply_to_id': in_reply_to,
+                'created_at': iso_time(now), 'media_attachments': []}
+
+    def media(self, is_twitter, size):
+        media_id = next(self.ids)
+
+        if is_twitter:
+            return {'media_id': media_id, 'media_id_string': str(media_id), 'size': size, 'expires_after_secs': 86400,
+                    'image': {'image_type': 'image/png', 'w': 512, 'h': 512}}
+
+        return {'id': str(media_id), 'type': 'image', 'url': f'{self.base_url}/media/{media_id}.png',
+                'preview_url': f'{self.base_url}/media/{media_id}_small.png', 'description': None}
+
+    @staticmethod
+    def send(handler, code, answer, headers=None):
+        body = json.dumps(answer).encode('utf-8')
+
+        handler.send_response(code)
+        handler.send_header('Content-Type', 'application/json; charset=utf-8')
+        handler.send_header('Content-Length', str(len(body)))
+
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def print_stats(self):
+        with self.lock:
+            stats = sorted(self.stats.items())
+
+        for key, count in stats:
+            print(f'{key}: {count}')
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == '__main__':
+    main()
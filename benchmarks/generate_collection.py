@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+#
+# GenerateCollection
+# Copyright 2021-2022 by Didier Malenfant.
+#
+# Write a synthetic Traktor collection.nml file for benchmarking.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import getopt
+import itertools
+import random
+import sys
+
+from xml.sax.saxutils import quoteattr
+
+# -- Common words and words that need normalizing or aren't latin, the rest of the vocabulary is made up.
+WORDS = ['love', 'night', 'deep', 'house', 'dub', 'acid', 'dream', 'city', 'lights', 'fire', 'soul', 'groove',
+         'machine', 'echo', 'sunrise', 'midnight', 'voices', 'rhythm', 'tribe', 'motion', 'gravity', 'ocean',
+         'Café', 'Señorita', 'Über', 'Déjà', 'Vu', 'Ñandú', 'Ça', 'Ålesund', 'Straße', 'Ørsted',
+         'Ночь', 'Любовь', 'Город', '夜', '東京', '愛', 'サウンド', '사랑', 'ﬁre', 'Ｔｏｋｙｏ', '♥', '🔥']
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'ne', 'to', 'su', 'vi', 'da', 'ze', 'bo', 'li', 'an', 'or', 'el', 'um',
+             'ski', 'tro', 'ber', 'lin', 'mar', 'nox', 'quo', 'rel', 'sha', 'tek', 'vor', 'xen', 'yul', 'zar']
+
+MIX_NAMES = ['Original Mix', 'Extended Mix', 'Dub', 'Radio Edit', 'Remix', 'VIP', 'Instrumental']
+
+# -- Odds that an entry is missing something or repeats another track.
+MISSING_LOCATION = 0.02
+MISSING_INFO = 0.05
+MISSING_LABEL = 0.15
+MISSING_TITLE_OR_ARTIST = 0.01
+DUPLICATE_TRACK = 0.03
+DUPLICATE_FILE = 0.01
+
+CHUNK_SIZE = 1000
+
+
+# -- Functions
+def track_title(rng, vocabulary):
+    title = vocabulary.words_between(1, 4)
+
+    roll = rng.random()
+    if roll < 0.3:
+        title += f' ({rng.choice(MIX_NAMES)})'
+    elif roll < 0.4:
+        title += f' (feat. {vocabulary.words_between(1, 2)})'
+    elif roll < 0.45:
+        title += f' [{vocabulary.words_between(1, 2)} Remix]'
+
+    return title
+
+
+def track_artist(rng, artists):
+    if rng.random() < 0.1:
+        return f'{rng.choice(artists)} & {rng.choice(artists)}'
+
+    return rng.choice(artists)
+
+
+def collection_entry(rng, vocabulary, index, title, artist, label, filename):
+    attributes = f'MODIFIED_DATE="2022/1/{index % 28 + 1}" MODIFIED_TIME="{index % 86400}" AUDIO_ID="{index:016x}"'
+
+    if title is not None:
+        attributes += f' TITLE={quoteattr(title)}'
+
+    if artist is not None:
+        attributes += f' ARTIST={quoteattr(artist)}'
+
+    lines = [f'<ENTRY {attributes}>']
+
+    if filename is not None:
+        directory, file = filename
+        lines.append(f'<LOCATION DIR={quoteattr(directory)} FILE={quoteattr(file)} VOLUME="Music" VOLUMEID="Music"></LOCATION>')
+
+    lines.append(f'<ALBUM TRACK="{index % 12 + 1}" TITLE={quoteattr(vocabulary.words_between(1, 3))}></ALBUM>')
+    lines.append('<MODIFICATION_INFO AUTHOR_TYPE="user"></MODIFICATION_INFO>')
+
+    if label is not False:
+        info = f'BITRATE="320000" GENRE="House" PLAYTIME="{rng.randint(150, 600)}" IMPORT_DATE="2021/6/1" FLAGS="12"'
+        if label is not None:
+            info += f' LABEL={quoteattr(label)}'
+
+        lines.append(f'<INFO {info}></INFO>')
+
+    lines.append(f'<TEMPO BPM="{rng.uniform(110, 135):.6f}" BPM_QUALITY="100.000000"></TEMPO>')
+    lines.append(f'<LOUDNESS PEAK_DB="-0.5" PERCEIVED_DB="{rng.uniform(-3, 3):.6f}" ANALYZED_DB="0.0"></LOUDNESS>')
+    lines.append(f'<MUSICAL_KEY VALUE="{rng.randint(0, 23)}"></MUSICAL_KEY>')
+
+    for cue in range(rng.randint(1, 4)):
+        lines.append(f'<CUE_V2 NAME="n.n." DISPL_ORDER="0" TYPE="{cue % 5}" START="{rng.uniform(0, 200000):.6f}" '
+                     f'LEN="0.000000" REPEATS="-1" HOTCUE="{cue}"></CUE_V2>')
+
+    lines.append('</ENTRY>')
+
+    return '\n'.join(lines) + '\n'
+
+
+def generate_collection(path, entry_count, seed=1):
+    """Write a collection.nml file with entry_count entries to path. The same seed always gives the same file."""
+
+    rng = random.Random(seed)
+    vocabulary = Vocabulary(rng, 1000 + entry_count // 4)
+    artists = [vocabulary.words_between(1, 3) for _ in range(max(10, entry_count // 8))]
+    labels = [vocabulary.words_between(1, 2) + ' Records' for _ in range(max(5, entry_count // 50))]
+
+    previous_tracks = []
+    previous_filenames = []
+    playlist_keys = []
+
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write('<?xml version="1.0" encoding="UTF-8" standalone="no" ?>\n')
+        file.write('<NML VERSION="19"><HEAD COMPANY="www.native-instruments.com" PROGRAM="Traktor"></HEAD>\n')
+        file.write('<MUSICFOLDERS></MUSICFOLDERS>\n')
+        file.write(f'<COLLECTION ENTRIES="{entry_count}">\n')
+
+        chunk = []
+        for index in range(entry_count):
+            roll = rng.random()
+
+            if roll < DUPLICATE_TRACK and len(previous_tracks) != 0:
+                # -- The same track imported again from somewhere else.
+                title, artist, label = rng.choice(previous_tracks)
+            else:
+                title = track_title(rng, vocabulary)
+                artist = track_artist(rng, artists)
+                label = None if rng.random() < MISSING_LABEL else rng.choice(labels)
+
+                if len(previous_tracks) < 10000:
+                    previous_tracks.append((title, artist, label))
+                else:
+                    previous_tracks[rng.randrange(len(previous_tracks))] = (title, artist, label)
+
+            if rng.random() < DUPLICATE_FILE and len(previous_filenames) != 0:
+                filename = rng.choice(previous_filenames)
+            else:
+                filename = (f'/:Users/:dj/:Music/:{artist[:32]}/:', f'{index:07d} {title[:48]}.mp3')
+
+                if len(previous_filenames) < 1000:
+                    previous_filenames.append(filename)
+
+            if rng.random() < MISSING_LOCATION:
+                filename = None
+
+            if rng.random() < MISSING_INFO:
+                label = False
+
+            if rng.random() < MISSING_TITLE_OR_ARTIST:
+                if rng.random() < 0.5:
+                    title = None
+                else:
+                    artist = None
+
+            chunk.append(collection_entry(rng, vocabulary, index, title, artist, label, filename))
+
+            if filename is not None and len(playlist_keys) < 5000:
+                playlist_keys.append('Music' + filename[0] + filename[1])
+
+            if len(chunk) == CHUNK_SIZE:
+                file.write(''.join(chunk))
+                chunk = []
+
+        file.write(''.join(chunk))
+        file.write('</COLLECTION>\n')
+
+        file.write('<PLAYLISTS><NODE TYPE="FOLDER" NAME="$ROOT"><SUBNODES COUNT="1">\n')
+        file.write(f'<NODE TYPE="PLAYLIST" NAME="Set"><PLAYLIST ENTRIES="{len(playlist_keys)}" TYPE="LIST">\n')
+
+        for key in playlist_keys:
+            file.write(f'<ENTRY><PRIMARYKEY TYPE="TRACK" KEY={quoteattr(key)}></PRIMARYKEY></ENTRY>\n')
+
+        file.write('</PLAYLIST></NODE></SUBNODES></NODE></PLAYLISTS>\n')
+        file.write('</NML>\n')
+
+
+def main():
+    entry_count = 10000
+    seed = 1
+
+    try:
+        opts, other_arguments = getopt.getopt(sys.argv[1:], 'n:s:')
+
+        for opt, arg_val in opts:
+            if opt == '-n':
+                entry_count = int(arg_val)
+            elif opt == '-s':
+                seed = int(arg_val)
+    except (getopt.GetoptError, ValueError):
+        other_arguments = []
+
+    if len(other_arguments) != 1:
+        print('usage: generate_collection.py <-n entries> <-s seed> collection.nml')
+        sys.exit(2)
+
+    generate_collection(other_arguments[0], entry_count, seed)
+
+
+# -- Classes
+class Vocabulary:
+    """Words picked with a Zipf distribution, like words in real track names: a few very common, most rare."""
+
+    def __init__(self, rng, size):
+        """Initialize a vocabulary of about size words."""
+
+        self.rng = rng
+        self.words = list(WORDS)
+
+        made_up_words = set()
+        while len(made_up_words) < size - len(WORDS):
+            made_up_words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 4))))
+
+        self.words.extend(sorted(made_up_words))
+        rng.shuffle(self.words)
+
+        self.cumulative_weights = list(itertools.accumulate(1 / rank for rank in range(1, len(self.words) + 1)))
+
+    def words_between(self, minimum, maximum):
+        count = self.rng.randint(minimum, maximum)
+        return ' '.join(word.capitalize() for word in self.rng.choices(self.words, cum_weights=self.cumulative_weights, k=count))
+
+
+if __name__ == '__main__':
+    main()
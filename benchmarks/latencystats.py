@@ -0,0 +1,42 @@
+#
+# LatencyStats
+# Copyright 2021-2022 by Didier Malenfant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+# -- Functions
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def latency_stats(values):
+    """Return the count, mean, median, 95th percentile and max of a list of durations in seconds."""
+
+    values = sorted(values)
+
+    return {
+        'count': len(values),
+        'mean_seconds': sum(values) / len(values),
+        'p50_seconds': percentile(values, 0.5),
+        'p95_seconds': percentile(values, 0.95),
+        'max_seconds': values[-1]
+    }
+
+
+def print_latency_stats(name, stats, unit='events'):
+    print(f'{name}: {stats["count"]} {unit}, {stats["mean_seconds"] * 1000:.1f}ms average, '
+          f'{stats["p50_seconds"] * 1000:.1f}ms median, {stats["p95_seconds"] * 1000:.1f}ms 95th percentile, '
+          f'{stats["max_seconds"] * 1000:.1f}ms max.')
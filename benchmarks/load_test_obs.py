@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+#
+# LoadTestOBS
+# Copyright 2021-2022 by Didier Malenfant.
+#
+# Drive OBSClient against benchmarks/fake_obs_server.py and measure how long scene
+# switches and requests take.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import getopt
+import json
+import obswebsocket.events
+import obswebsocket.requests
+import os
+import sys
+
+from datetime import datetime, timezone
+from threading import Condition, Semaphore
+from time import monotonic
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_obs_server import FakeOBSServer    # noqa: E402
+from latencystats import latency_stats, print_latency_stats    # noqa: E402
+from metrics import default_metrics    # noqa: E402
+from obsclient import OBSClient    # noqa: E402
+from workqueue import WorkQueue    # noqa: E402
+
+PASSWORD = 'load test'
+
+SCENE_CHANNEL = 1
+STREAM_STATUS_NOTE = 100
+SCENE_VELOCITY = 127
+
+# -- How long we wait for anything before deciding it isn't coming.
+TIMEOUT = 10
+
+
+# -- Functions
+def obs_config(port, scene_count):
+    return {
+        'ObsServerAddress': '127.0.0.1',
+        'ObsServerPort': str(port),
+        'ObsServerPassword': PASSWORD,
+        'CurrentSceneChannel': str(SCENE_CHANNEL),
+        'CurrentSceneVelocity': str(SCENE_VELOCITY),
+        'SceneSelectionNotes': ','.join(str(note) for note in range(scene_count)),
+        'StreamStatusNote': str(STREAM_STATUS_NOTE),
+        'StreamStatusChannel': str(SCENE_CHANNEL),
+        'StreamOnVelocity': '127',
+        'StreamOffVelocity': '1'
+    }
+
+
+def switch_scenes(obs_client, midi_client, switch_count, scene_count, transition_duration):
+    """Press scene notes like a DJ would and return how long until the scene's note lights up and the transition ends."""
+
+    switch_latencies = []
+    transition_latencies = []
+    transitions = TransitionWatcher(obs_client)
+
+    for index in range(switch_count):
+        note = (index + 1) % scene_count
+        press_time = monotonic()
+
+        midi_client.press(SCENE_CHANNEL - 1, note)
+
+        lit_time = midi_client.wait_for_note(SCENE_CHANNEL - 1, note, SCENE_VELOCITY, press_time)
+        if lit_time is None:
+            print(f'Scene note {note} never lit up.')
+            continue
+
+        switch_latencies.append(lit_time - press_time)
+
+        if transition_duration <= 0:
+            continue
+
+        # -- Scene changes are ignored during a transition, so we wait for it to end like a DJ would.
+        end_time = transitions.wait_for_end(press_time)
+        if end_time is None:
+            print(f'Transition to scene {note + 1} never ended.')
+            continue
+
+        transition_latencies.append(end_time - press_time)
+
+    return switch_latencies, transition_latencies
+
+
+def send_requests(connection, request_count, concurrency):
+    """Send request_count requests with at most concurrency of them waiting for an answer and return their latencies."""
+
+    latencies = []
+    slots = Semaphore(concurrency)
+
+    def on_answer(future, sent_time):
+        latencies.append(monotonic() - sent_time)
+        slots.release()
+
+    for _ in range(request_count):
+        slots.acquire()
+
+        sent_time = monotonic()
+        future = connection.submit(obswebsocket.requests.GetStreamingStatus())
+        future.add_done_callback(lambda future, sent_time=sent_time: on_answer(future, sent_time))
+
+    for _ in range(concurrency):
+        slots.acquire()
+
+    return latencies
+
+
+def main():
+    switch_count = 100
+    request_count = 2000
+    concurrency = 16
+    latency = 0.005
+    jitter = 0.0
+    transition_duration = 0.3
+    scene_count = 8
+    output_path = None
+
+    try:
+        opts, other_arguments = getopt.getopt(sys.argv[1:], 'n:r:c:l:j:t:s:o:')
+
+        for opt, arg_val in opts:
+            if opt == '-n':
+                switch_count = int(arg_val)
+            elif opt == '-r':
+                request_count = int(arg_val)
+            elif opt == '-c':
+                concurrency = int(arg_val)
+            elif opt == '-l':
+                latency = float(arg_val)
+            elif opt == '-j':
+                jitter = float(arg_val)
+            elif opt == '-t':
+                transition_duration = float(arg_val)
+            elif opt == '-s':
+                scene_count = int(arg_val)
+            elif opt == '-o':
+                output_path = arg_val
+
+        if scene_count < 2 or concurrency < 1:
+            raise ValueError
+    except (getopt.GetoptError, ValueError):
+        other_arguments = ['']
+
+    if len(other_arguments) != 0:
+        print('usage: load_test_obs.py <-n scene switches> <-r requests> <-c concurrency> <-l latency seconds> '
+              '<-j jitter seconds> <-t transition seconds> <-s scenes> <-o results.json>')
+        sys.exit(2)
+
+    server = FakeOBSServer(0, scenes=[f'Scene {index + 1}' for index in range(scene_count)],
+                           transition_duration=transition_duration, latency=latency, jitter=jitter, password=PASSWORD)
+
+    midi_client = LoadTestMidiClient()
+    obs_client = OBSClient(obs_config(server.port, scene_count), midi_client, [])
+
+    try:
+        # -- The first scene lights up once we are connected and synced with OBS.
+        if midi_client.wait_for_note(SCENE_CHANNEL - 1, 0, SCENE_VELOCITY, 0) is None:
+            print('Couldn\'t sync with the fake OBS.')
+            sys.exit(1)
+
+        print(f'Switching scenes {switch_count} times...')
+        switch_latencies, transition_latencies = switch_scenes(obs_client, midi_client, switch_count, scene_count,
+                                                               transition_duration)
+
+        print(f'Sending {request_count} requests, {concurrency} at a time...')
+        start_time = monotonic()
+        request_latencies = send_requests(obs_client.connection, request_count, concurrency)
+        request_seconds = monotonic() - start_time
+    finally:
+        obs_client.shutdown()
+        midi_client.shutdown()
+        server.shutdown()
+
+    results = {
+        'date': datetime.now(timezone.utc).isoformat(),
+        'latency': latency,
+        'jitter': jitter,
+        'concurrency': concurrency,
+        'scene_switch': latency_stats(switch_latencies) if len(switch_latencies) != 0 else None,
+        'scene_switch_with_transition': latency_stats(transition_latencies) if len(transition_latencies) != 0 else None,
+        'requests': latency_stats(request_latencies) if len(request_latencies) != 0 else None,
+        'requests_per_second': len(request_latencies) / request_seconds if request_seconds > 0 else None,
+        'server_requests': server.request_count
+    }
+
+    print('')
+    for name in ('scene_switch', 'scene_switch_with_transition', 'requests'):
+        if results[name] is not None:
+            print_latency_stats(name.replace('_', ' ').capitalize(), results[name], 'times')
+
+    if results['requests_per_second'] is not None:
+        print(f'{results["requests_per_second"]:.0f} requests per second.')
+
+    print('')
+    default_metrics.print_summary()
+
+    if output_path is not None:
+        with open(output_path, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+# -- Classes
+class LoadTestMidiClient:
+    """Stand-in for a MidiClient that remembers when each note was last turned on."""
+
+    def __init__(self):
+        """Initialize the client. Callbacks run on one work queue, like the ones MidiClient gives OBSClient."""
+
+        self.callbacks = {}
+        self.work_queue = WorkQueue('obs')
+        self.condition = Condition()
+        self.notes = {}
+
+    def add_callback(self, channel, note, callback, subsystem='midi'):
+        self.callbacks[(channel, note)] = callback
+
+    def press(self, channel, note):
+        self.work_queue.put(f'channel {channel + 1} note {note}', self.callbacks[(channel, note)], channel, note)
+
+    def note_on(self, note, channel, velocity):
+        with self.condition:
+            self.notes[(channel, note)] = (velocity, monotonic())
+            self.condition.notify_all()
+
+    def note_off(self, note, channel):
+        with self.condition:
+            self.notes[(channel, note)] = (0, monotonic())
+            self.condition.notify_all()
+
+    def wait_for_note(self, channel, note, velocity, since):
+        """Return when note was turned on with velocity after since, or None if it doesn't happen soon."""
+
+        def note_is_on():
+            state = self.notes.get((channel, note), None)
+            return state is not None and state[0] == velocity and state[1] >= since
+
+        with self.condition:
+            if not self.condition.wait_for(note_is_on, TIMEOUT):
+                return None
+
+            return self.notes[(channel, note)][1]
+
+    def shutdown(self):
+        self.work_queue.stop()
+        self.work_queue.wait_until_stopped(1)
+
+
+class TransitionWatcher:
+    """Remember when OBSClient last finished handling the end of a scene transition."""
+
+    def __init__(self, obs_client):
+        """Initialize the watcher for obs_client."""
+
+        self.obs_client = obs_client
+        self.condition = Condition()
+        self.end_time = 0
+
+        # -- Handlers are called in the order they were registered, so our marker is queued after OBSClient's event.
+        obs_client.connection.register(self.on_transition_end, obswebsocket.events.TransitionEnd)
+
+    def on_transition_end(self, message):
+        self.obs_client.events.put('load test', self.transition_ended)
+
+    def transition_ended(self):
+        with self.condition:
+            self.end_time = monotonic()
+            self.condition.notify_all()
+
+    def wait_for_end(self, since):
+        """Return when a transition ended after since, or None if it doesn't happen soon."""
+
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.end_time >= since, TIMEOUT):
+                return None
+
+            return self.end_time
+
+
+if __name__ == '__main__':
+    main()
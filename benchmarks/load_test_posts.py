@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+#
+# LoadTestPosts
+# Copyright 2021-2022 by Didier Malenfant.
+#
+# Post a whole set's worth of tracks through TwitterClient or MastodonClient against
+# benchmarks/fake_social_server.py, and measure how long posts take to go out.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import getopt
+import json
+import os
+import random
+import sys
+import tempfile
+
+from datetime import datetime, timezone
+from time import monotonic, sleep
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from artworkpayload import ArtworkPayload    # noqa: E402
+from fake_social_server import FakeSocialServer, make_certificate    # noqa: E402
+from latencystats import latency_stats, print_latency_stats    # noqa: E402
+from mastodonclient import MastodonClient    # noqa: E402
+from metrics import default_metrics    # noqa: E402
+from outbox import Outbox    # noqa: E402
+from postqueue import PostQueue    # noqa: E402
+from twitterclient import TwitterClient    # noqa: E402
+
+POSTS_CONFIG = {
+    'StreamStartText': 'Stream is starting!',
+    'StreamStopText': 'Stream is over, thanks for listening!',
+    'TrackUpdateText': 'Now playing: {title} by {artist} [{label}]',
+    'TrackUpdateNoLabelText': 'Now playing: {title} by {artist}'
+}
+
+# -- Tracks reuse a few covers, like albums played more than once in a set do.
+ARTWORK_COUNT = 4
+ARTWORK_SIZE = 64 * 1024
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+# -- Functions
+def new_client(client_name, server, certificate):
+    if client_name == 'twitter':
+        client = TwitterClient({'ConsumerKey': 'key', 'ConsumerSecret': 'secret', 'AccessToken': 'token',
+                                'AccessTokenSecret': 'token secret', 'APIHost': server.host, 'UploadHost': server.host},
+                               POSTS_CONFIG)
+
+        # -- Our server's certificate is self-signed. requests prefers a CA bundle from the environment to the session's.
+        client.api.session.verify = certificate
+        client.api.session.trust_env = False
+        return client
+
+    return MastodonClient({'ClientID': 'id', 'ClientSecret': 'secret', 'AccessToken': 'token',
+                           'APIBaseURL': server.base_url}, POSTS_CONFIG)
+
+
+def threaded_status_count(statuses):
+    """Return how many statuses reply to the one posted right before them."""
+
+    return sum(1 for previous, status in zip(statuses, statuses[1:]) if status[2] == str(previous[0]))
+
+
+def main():
+    client_name = 'mastodon'
+    post_count = 100
+    interval = 0.0
+    latency = 0.1
+    rate_limit_odds = 0.0
+    error_odds = 0.0
+    coalescing_window = 0.0
+    retry_delay = 1.0
+    output_path = None
+
+    try:
+        opts, other_arguments = getopt.getopt(sys.argv[1:], 'c:n:i:l:r:e:w:d:o:')
+
+        for opt, arg_val in opts:
+            if opt == '-c':
+                client_name = arg_val
+            elif opt == '-n':
+                post_count = int(arg_val)
+            elif opt == '-i':
+                interval = float(arg_val)
+            elif opt == '-l':
+                latency = float(arg_val)
+            elif opt == '-r':
+                rate_limit_odds = float(arg_val)
+            elif opt == '-e':
+                error_odds = float(arg_val)
+            elif opt == '-w':
+                coalescing_window = float(arg_val)
+            elif opt == '-d':
+                retry_delay = float(arg_val)
+            elif opt == '-o':
+                output_path = arg_val
+
+        if client_name not in ('twitter', 'mastodon'):
+            raise ValueError
+    except (getopt.GetoptError, ValueError):
+        other_arguments = ['']
+
+    if len(other_arguments) != 0:
+        print('usage: load_test_posts.py <-c twitter|mastodon> <-n posts> <-i interval seconds> <-l latency seconds> '
+              '<-r rate limit odds> <-e error odds> <-w coalescing window> <-d retry delay> <-o results.json>')
+        sys.exit(2)
+
+    # -- Retrying after the usual delays would make the test last for hours.
+    PostQueue.FIRST_RETRY_DELAY = retry_delay
+
+    rng = random.Random(1)
+    artworks = [ArtworkPayload(PNG_SIGNATURE + rng.randbytes(ARTWORK_SIZE)) for _ in range(ARTWORK_COUNT)]
+
+    with tempfile.TemporaryDirectory() as folder:
+        certificate = make_certificate(folder) if client_name == 'twitter' else None
+        server = FakeSocialServer(latency=latency, jitter=latency / 2, rate_limit_odds=rate_limit_odds,
+                                  error_odds=error_odds, certificate=certificate)
+
+        outbox = Outbox(os.path.join(folder, 'outbox.db'))
+        post_queue = PostQueue(client_name, new_client(client_name, server, certificate), outbox, coalescing_window)
+
+        queue_durations = []
+        start_time = monotonic()
+
+        post_queue.post_start_text()
+
+        for index in range(post_count):
+            queued_time = monotonic()
+            post_queue.post_status(f'Track {index}', f'Artist {index % 17}', f'Label {index % 5}' if index % 3 else None,
+                                   rng.choice(artworks) if index % 4 else None)
+            queue_durations.append(monotonic() - queued_time)
+
+            if interval > 0:
+                sleep(interval)
+
+        post_queue.post_stop_text()
+        queued_seconds = monotonic() - start_time
+
+        while outbox.pending_count(client_name) != 0:
+            sleep(0.05)
+
+        total_seconds = monotonic() - start_time
+
+        post_queue.stop()
+        post_queue.wait_until_stopped(10)
+        server.shutdown()
+
+    statuses = server.statuses
+    results = {
+        'client': client_name,
+        'date': datetime.now(timezone.utc).isoformat(),
+        'posts_queued': post_count + 2,
+        'statuses_posted': len(statuses),
+        'statuses_threaded': threaded_status_count(statuses),
+        'queued_seconds': queued_seconds,
+        'total_seconds': total_seconds,
+        'statuses_per_second': len(statuses) / total_seconds,
+        'queue_post': latency_stats(queue_durations) if len(queue_durations) != 0 else None,
+        'server': server.stats
+    }
+
+    print('')
+    print(f'{results["statuses_posted"]} statuses posted from {results["posts_queued"]} posts in {total_seconds:.1f}s, '
+          f'{results["statuses_per_second"]:.1f}/s, {results["statuses_threaded"]} replying to the previous one.')
+
+    if results['queue_post'] is not None:
+        print_latency_stats('Queueing a post', results['queue_post'], 'posts')
+
+    server.print_stats()
+
+    print('')
+    default_metrics.print_summary()
+
+    if output_path is not None:
+        with open(output_path, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
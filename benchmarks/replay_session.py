@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+#
+# ReplaySession
+# Copyright 2021-2022 by Didier Malenfant.
+#
+# Replay a session recorded with StreamManager.py -s against stand-ins for the midi
+# device, OBS and the social networks, and measure how long each event takes to handle.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import asyncio
+import configparser
+import getopt
+import json
+import mido
+import obswebsocket.events
+import os
+import sys
+import tempfile
+
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from functools import partial
+from threading import Lock, Timer
+from time import monotonic, sleep
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from asyncruntime import AsyncRuntime    # noqa: E402
+from latencystats import latency_stats, print_latency_stats    # noqa: E402
+from metrics import default_metrics    # noqa: E402
+from midiclient import MidiClient    # noqa: E402
+from midioutput import MidiOutput    # noqa: E402
+from obsclient import OBSClient    # noqa: E402
+from outbox import Outbox    # noqa: E402
+from postqueue import PostQueue    # noqa: E402
+from scheduler import Scheduler    # noqa: E402
+from sessionrecorder import read_session    # noqa: E402
+from traktorclient import TraktorClient    # noqa: E402
+from workqueue import WorkQueue    # noqa: E402
+
+# -- Where the overlay files go instead of where OBS reads them.
+OVERLAY_KEYS = ('OutputTitleFilename', 'OutputArtistFilename', 'OutputLabelFilename', 'OutputArtworkFilename')
+
+COLLECTION_LOAD_TIMEOUT = 600
+
+
+# -- Functions
+def scene_names(events):
+    """Return the names of the scenes OBS mentions in events, in the order they first appear."""
+
+    names = {}
+
+    for event in events:
+        if event['source'] != 'obs':
+            continue
+
+        data = event['data']
+
+        for key in ('scene-name', 'from-scene', 'to-scene'):
+            if isinstance(data.get(key, None), str):
+                names.setdefault(data[key], None)
+
+        for scene in data.get('scenes', None) or []:
+            names.setdefault(scene['name'], None)
+
+    return list(names)
+
+
+def main():
+    speed = 1.0
+    output_path = None
+    post_latency = 0.2
+    obs_latency = 0.005
+    use_asyncio = False
+
+    try:
+        opts, other_arguments = getopt.getopt(sys.argv[1:], 'ax:o:p:b:')
+
+        for opt, arg_val in opts:
+            if opt == '-a':
+                use_asyncio = True
+            elif opt == '-x':
+                speed = float(arg_val)
+            elif opt == '-o':
+                output_path = arg_val
+            elif opt == '-p':
+                post_latency = float(arg_val)
+            elif opt == '-b':
+                obs_latency = float(arg_val)
+
+        if speed <= 0:
+            raise ValueError
+    except (getopt.GetoptError, ValueError):
+        other_arguments = []
+
+    if len(other_arguments) != 2:
+        print('usage: replay_session.py <-asyncio> <-x speed> <-p post latency> <-b obs latency> <-o results.json> '
+              'session.jsonl config.ini')
+        sys.exit(2)
+
+    session_path, config_file_path = other_arguments
+
+    if not os.path.exists(config_file_path):
+        print(f'Can\'t read ini file at \'{config_file_path}\'.')
+        sys.exit(2)
+
+    header, events = read_session(session_path)
+
+    config = configparser.ConfigParser()
+    config.read(config_file_path)
+
+    with tempfile.TemporaryDirectory() as folder:
+        replay = SessionReplay(config, folder, events, speed, post_latency, obs_latency, use_asyncio)
+
+        print(f'Replaying {len(events)} events recorded on {header["started"]} at {speed:g}x...')
+
+        try:
+            replay.run()
+        finally:
+            replay.shutdown()
+
+    results = {
+        'session': os.path.basename(session_path),
+        'date': datetime.now(timezone.utc).isoformat(),
+        'speed': speed,
+        'asyncio': use_asyncio,
+        'events': {kind: latency_stats(values) for kind, values in sorted(replay.latencies.items())},
+        'lag': latency_stats(replay.lags) if len(replay.lags) != 0 else None
+    }
+
+    print('')
+    for kind, stats in results['events'].items():
+        print_latency_stats(kind, stats)
+
+    if results['lag'] is not None:
+        print(f'Replay lag: {results["lag"]["p95_seconds"] * 1000:.1f}ms 95th percentile, '
+              f'{results["lag"]["max_seconds"] * 1000:.1f}ms max.')
+
+    print('')
+    default_metrics.print_summary()
+
+    if output_path is not None:
+        with open(output_path, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+# -- Classes
+class ReplayMidiPort:
+    """Stand-in for a mido output port that drops what it is sent."""
+
+    def send(self, message):
+        pass
+
+    def close(self):
+        pass
+
+
+class ReplayOBSConnection:
+    """Stand-in for an OBSConnection to an OBS with scenes, which answers every request after latency seconds.
+
+    Events are only sent when emit() is called.
+    """
+
+    def __init__(self, scenes, latency, address, port, password, on_connected=None):
+        """Initialize the connection. Like OBSConnection, on_connected is called once we are connected."""
+
+        self.scenes = scenes
+        self.latency = latency
+        self.on_connected = on_connected
+        self.handlers = []
+
+    def connect(self):
+        if self.on_connected is not None:
+            self.on_connected()
+
+    def register(self, handler, event):
+        self.handlers.append((handler, event))
+
+    def emit(self, name, data):
+        """Send the event called name with data, as OBS would have."""
+
+        event = getattr(obswebsocket.events, name)()
+        event.input(dict(data, **{'update-type': name}))
+
+        for handler, event_class in self.handlers:
+            if isinstance(event, event_class):
+                handler(event)
+
+    def call(self, request):
+        return self.submit(request).result()
+
+    def call_batch(self, requests):
+        return self.submit_batch(requests).result()
+
+    def submit(self, request):
+        self.answer(request)
+
+        return self.later(request)
+
+    def submit_batch(self, requests):
+        requests = list(requests)
+
+        for request in requests:
+            self.answer(request)
+
+        return self.later(requests)
+
+    def answer(self, request):
+        if request.name == 'GetSceneList':
+            datain = {'current-scene': self.scenes[0] if len(self.scenes) != 0 else None,
+                      'scenes': [{'name': name, 'sources': []} for name in self.scenes]}
+        elif request.name == 'GetStreamingStatus':
+            datain = {'streaming': False, 'recording': False}
+        else:
+            datain = {}
+
+        request.input(dict(datain, **{'message-id': '0', 'status': 'ok'}))
+
+    def later(self, result):
+        future = Future()
+
+        if self.latency > 0:
+            Timer(self.latency, future.set_result, (result,)).start()
+        else:
+            future.set_result(result)
+
+        return future
+
+    def shutdown(self, timeout=1):
+        pass
+
+
+class ReplayPostClient:
+    """Stand-in for a TwitterClient or MastodonClient that takes latency seconds to post."""
+
+    def __init__(self, name, latency):
+        """Initialize the client."""
+
+        self.name = name
+        self.latency = latency
+        self.stream_start_text = 'Stream started.'
+        self.stream_stop_text = 'Stream stopped.'
+        self.lock = Lock()
+        self.post_count = 0
+
+    def send_status(self, text, in_reply_to=None, artwork=None):
+        sleep(self.latency)
+
+        with self.lock:
+            self.post_count += 1
+            return f'{self.name}-{self.post_count}'
+
+    def status_text(self, title, artist, label=None):
+        if label is None or len(label) == 0:
+            return f'{title} by {artist}'
+
+        return f'{title} by {artist} [{label}]'
+
+    @staticmethod
+    def is_permanent_error(error):
+        return False
+
+    @staticmethod
+    def rate_limit_reset_time(error):
+        return None
+
+
+class SessionReplay:
+    """Our clients wired together like StreamManager does, with stand-ins for everything outside of us."""
+
+    def __init__(self, config, folder, events, speed, post_latency, obs_latency, use_asyncio):
+        """Initialize the clients. Every file we write goes in folder."""
+
+        self.events = events
+        self.speed = speed
+        self.latencies = {}
+        self.lags = []
+        self.lock = Lock()
+        self.runtime = None
+
+        if use_asyncio:
+            self.runtime = AsyncRuntime()
+            self.scheduler = self.runtime
+            new_work_queue = self.runtime.new_work_queue
+        else:
+            self.scheduler = Scheduler()
+            new_work_queue = WorkQueue
+
+        # -- No device is called that, we plug our own output in instead.
+        config['midi']['InputDeviceName'] = ''
+        config['midi']['OutputDeviceName'] = ''
+
+        self.midi_client = MidiClient(config['midi'], new_work_queue)
+        self.midi_client.midi_output = ReplayMidiPort()
+        self.midi_client.output = MidiOutput(self.midi_client.midi_output,
+                                             int(config['midi'].get('OutputMessagesPerSecond', '500')))
+
+        outbox = Outbox(os.path.join(folder, 'outbox.db'))
+        coalescing_window = float(config['posts'].get('TrackPostCoalescingWindow', '5')) / speed
+        self.post_queues = [PostQueue(name, ReplayPostClient(name, post_latency), outbox, coalescing_window)
+                            for name in ('twitter', 'mastodon')]
+
+        for key in OVERLAY_KEYS:
+            config['traktor'][key] = os.path.join(folder, os.path.basename(config['traktor'][key]))
+
+        # -- The collection is parsed again instead of overwriting the cache the real thing uses.
+        config['traktor']['CollectionCacheFilename'] = os.path.join(folder, 'collection.db')
+
+        self.traktor_client = TraktorClient(config['traktor'], self.midi_client, self.post_queues, self.scheduler,
+                                            new_work_queue=new_work_queue)
+
+        new_connection = partial(ReplayOBSConnection, scene_names(events), obs_latency)
+        self.obs_client = OBSClient(config['obs'], self.midi_client, self.post_queues, new_work_queue, new_connection)
+
+    def run(self):
+        # -- Events are replayed from an event loop, like StreamManager listens to Traktor in either mode.
+        if self.runtime is None:
+            asyncio.run(self.replay_events())
+        else:
+            self.runtime.serve(self.replay_events())
+
+    async def replay_events(self):
+        self.traktor_client.start_background_tasks()
+        self.obs_client.connection.connect()
+
+        # -- Tracks announced before the collection is loaded are looked up once it is, which isn't what we want to measure.
+        start_time = monotonic()
+        while not self.traktor_client.collection_loaded:
+            if monotonic() - start_time > COLLECTION_LOAD_TIMEOUT:
+                print('The Traktor collection didn\'t load, giving up.')
+                return
+
+            await asyncio.sleep(0.1)
+
+        if len(self.events) == 0:
+            return
+
+        first_event_time = self.events[0]['time']
+        start_time = monotonic()
+
+        for event in self.events:
+            due_time = start_time + (event['time'] - first_event_time) / self.speed
+
+            delay = due_time - monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            self.lags.append(max(0.0, monotonic() - due_time))
+            self.replay_event(event)
+
+    def replay_event(self, event):
+        source = event['source']
+        kind = f'{source} {event["event"]}'
+        start_time = monotonic()
+
+        if source == 'traktor':
+            # -- Like the ingest server does, the track info is queued from the event loop and handled on its worker.
+            self.traktor_client.queue_meta([tuple(item) for item in event['data']])
+            self.traktor_client.meta_updates.put('replay', self.add_latency, kind, start_time)
+        elif source == 'midi':
+            data = event['data']
+            self.midi_client.on_midi_msg(mido.Message(event['event'], channel=data['channel'], note=data['note'],
+                                                      velocity=data['velocity']))
+
+            # -- Work queues run in order so the event is handled once anything we queue after it runs.
+            mapping = self.midi_client.note_on_callbacks.get(data['channel'], {}).get(data['note'], None)
+            if mapping is None:
+                self.add_latency(kind, start_time)
+            else:
+                mapping[0].put('replay', self.add_latency, kind, start_time)
+        elif source == 'obs':
+            self.obs_client.connection.emit(event['event'], event['data'])
+            self.obs_client.events.put('replay', self.add_latency, kind, start_time)
+
+    def add_latency(self, kind, start_time):
+        latency = monotonic() - start_time
+
+        with self.lock:
+            self.latencies.setdefault(kind, []).append(latency)
+
+    def shutdown(self):
+        self.scheduler.shutdown()
+        self.traktor_client.shutdown()
+        self.midi_client.shutdown()
+        self.obs_client.shutdown()
+
+        for post_queue in self.post_queues:
+            post_queue.stop()
+
+        for post_queue in self.post_queues:
+            post_queue.wait_until_stopped(10)
+
+        if self.runtime is not None:
+            self.runtime.close()
+
+
+if __name__ == '__main__':
+    main()
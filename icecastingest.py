@@ -0,0 +1,342 @@
+#
+# IcecastIngest
+# Copyright 2021-2022 by Didier Malenfant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import asyncio
+import struct
+
+from functools import partial
+from metrics import counter
+
+INGESTED_BYTES = counter('streammanager_ingest_bytes_total', 'Bytes received from Traktor broadcasts.')
+INGESTED_COMMENTS = counter('streammanager_ingest_comments_total', 'Vorbis comment headers found in Traktor broadcasts.')
+
+OGG_PAGE_HEADER_SIZE = 27
+OGG_CAPTURE_PATTERN = b'OggS'
+OGG_VERSION_INDEX = 4
+OGG_FLAGS_INDEX = 5
+OGG_CONTINUED_PACKET = 0x01
+VORBIS_COMMENT_HEADER = b'\x03vorbis'
+
+# -- Comments are a few hundred bytes, anything bigger than this isn't something we want to keep in memory.
+MAX_COMMENT_SIZE = 256 * 1024
+MAX_REQUEST_SIZE = 16 * 1024
+READ_BUFFER_SIZE = 64 * 1024
+
+
+# -- Functions
+def parse_vorbis_comment(packet):
+    """Return the (key, value) tuples in a Vorbis comment header packet, with lowercase keys.
+
+    Anything after a malformed comment is ignored.
+    """
+
+    comments = []
+
+    try:
+        offset = len(VORBIS_COMMENT_HEADER)
+        vendor_length, = struct.unpack_from('<I', packet, offset)
+        offset += 4 + vendor_length
+
+        comment_count, = struct.unpack_from('<I', packet, offset)
+        offset += 4
+
+        for _ in range(comment_count):
+            length, = struct.unpack_from('<I', packet, offset)
+            offset += 4
+
+            if offset + length > len(packet):
+                break
+
+            comment = bytes(packet[offset:offset + length]).decode('utf-8', errors='replace')
+            offset += length
+
+            key, separator, value = comment.partition('=')
+            if separator:
+                comments.append((key.lower(), value))
+    except struct.error:
+        pass
+
+    return comments
+
+
+# -- Classes
+class OggCommentParser:
+    """Find the Vorbis comment headers in an Ogg stream fed to us a chunk at a time.
+
+    Only page headers and comment packets are kept, audio packets are skipped over as
+    they go by. on_comment is called with the (key, value) tuples of each comment header.
+    """
+
+    def __init__(self, on_comment):
+        """Initialize the parser, expecting the start of a page."""
+
+        self.on_comment = on_comment
+        self.header = bytearray()
+        self.pieces = []
+        self.piece_index = 0
+        self.piece_remaining = 0
+
+        # -- kind is None at the start of a packet, until we've seen enough of it to know if it's a comment.
+        self.kind = None
+        self.packet = bytearray()
+
+    def feed(self, data):
+        view = memoryview(data)
+
+        while len(view) != 0:
+            if self.piece_index == len(self.pieces):
+                view = self.read_page_header(view)
+            else:
+                view = self.read_page_body(view)
+
+    def read_page_header(self, view):
+        wanted = OGG_PAGE_HEADER_SIZE if len(self.header) < OGG_PAGE_HEADER_SIZE else \
+            OGG_PAGE_HEADER_SIZE + self.header[OGG_PAGE_HEADER_SIZE - 1]
+
+        count = min(wanted - len(self.header), len(view))
+        self.header += view[:count]
+        view = view[count:]
+
+        if (len(self.header) >= len(OGG_CAPTURE_PATTERN) and not self.header.startswith(OGG_CAPTURE_PATTERN)) or \
+                (len(self.header) > OGG_VERSION_INDEX and self.header[OGG_VERSION_INDEX] != 0):
+            # -- We lost track of the pages, skip ahead to what looks like the next one.
+            index = self.header.find(OGG_CAPTURE_PATTERN, 1)
+            del self.header[:index if index > 0 else len(self.header) - len(OGG_CAPTURE_PATTERN) + 1]
+            self.start_packet()
+            return view
+
+        if len(self.header) >= OGG_PAGE_HEADER_SIZE and \
+                len(self.header) == OGG_PAGE_HEADER_SIZE + self.header[OGG_PAGE_HEADER_SIZE - 1]:
+            self.start_page()
+
+        return view
+
+    def start_page(self):
+        continued = (self.header[OGG_FLAGS_INDEX] & OGG_CONTINUED_PACKET) != 0
+
+        if continued and self.kind is None and len(self.packet) == 0:
+            # -- We never saw the start of this packet.
+            self.kind = 'other'
+        elif not continued and (self.kind is not None or len(self.packet) != 0):
+            self.start_packet()
+
+        # -- Segments of 255 bytes continue a packet, so we merge them into pieces that either end a packet or the page.
+        self.pieces = []
+        size = 0
+
+        for lacing_value in self.header[OGG_PAGE_HEADER_SIZE:]:
+            size += lacing_value
+
+            if lacing_value < 255:
+                self.pieces.append((size, True))
+                size = 0
+
+        if size != 0:
+            self.pieces.append((size, False))
+
+        self.header.clear()
+        self.piece_index = 0
+        self.piece_remaining = self.pieces[0][0] if len(self.pieces) != 0 else 0
+
+        self.end_empty_pieces()
+
+    def read_page_body(self, view):
+        count = min(self.piece_remaining, len(view))
+
+        if self.kind != 'other':
+            self.add_to_packet(view[:count])
+
+        self.piece_remaining -= count
+
+        if self.piece_remaining == 0:
+            self.end_piece()
+
+        return view[count:]
+
+    def add_to_packet(self, chunk):
+        if self.kind is None:
+            wanted = len(VORBIS_COMMENT_HEADER) - len(self.packet)
+            self.packet += chunk[:wanted]
+
+            if len(self.packet) < len(VORBIS_COMMENT_HEADER):
+                return
+
+            chunk = chunk[wanted:]
+
+            if self.packet == VORBIS_COMMENT_HEADER:
+                self.kind = 'comment'
+            else:
+                self.kind = 'other'
+                self.packet.clear()
+                return
+
+        if len(self.packet) + len(chunk) > MAX_COMMENT_SIZE:
+            self.kind = 'other'
+            self.packet.clear()
+            return
+
+        self.packet += chunk
+
+    def end_piece(self):
+        size, ends_packet = self.pieces[self.piece_index]
+
+        if ends_packet:
+            if self.kind == 'comment':
+                INGESTED_COMMENTS.inc()
+                self.on_comment(parse_vorbis_comment(self.packet))
+
+            self.start_packet()
+
+        self.piece_index += 1
+        if self.piece_index != len(self.pieces):
+            self.piece_remaining = self.pieces[self.piece_index][0]
+            self.end_empty_pieces()
+
+    def end_empty_pieces(self):
+        # -- A packet can end with an empty segment, and there's nothing to wait for then.
+        if self.piece_index != len(self.pieces) and self.piece_remaining == 0:
+            self.end_piece()
+
+    def start_packet(self):
+        self.kind = None
+        self.packet.clear()
+
+
+class IcecastSourceProtocol(asyncio.BufferedProtocol):
+    """One Traktor broadcasting to us, the way it would to an Icecast server.
+
+    Reads go to the same buffer every time, and only the metadata in the stream is kept.
+    """
+
+    def __init__(self, server, port):
+        """Initialize the protocol for a connection made to server on port."""
+
+        self.server = server
+        self.port = port
+        self.transport = None
+        self.buffer = bytearray(READ_BUFFER_SIZE)
+        self.request = bytearray()
+        self.parser = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.connections.add(self)
+
+    def get_buffer(self, sizehint):
+        return self.buffer
+
+    def buffer_updated(self, nbytes):
+        INGESTED_BYTES.inc(nbytes, port=str(self.port))
+
+        data = memoryview(self.buffer)[:nbytes]
+
+        if self.parser is None:
+            data = self.read_request(data)
+
+        if data is not None and len(data) != 0:
+            self.parser.feed(data)
+
+    def read_request(self, data):
+        """Read the request in front of the stream and answer it. Returns whatever followed it, if anything."""
+
+        self.request += data
+
+        end_index = self.request.find(b'\r\n\r\n')
+        if end_index < 0:
+            if len(self.request) > MAX_REQUEST_SIZE:
+                self.answer(b'HTTP/1.0 431 Request Header Fields Too Large\r\n\r\n', close=True)
+
+            return None
+
+        lines = bytes(self.request[:end_index]).decode('latin-1').split('\r\n')
+        rest = bytes(self.request[end_index + 4:])
+        self.request = None
+
+        request_line = lines[0].split(' ')
+        method = request_line[0]
+        mount = request_line[1] if len(request_line) > 1 else '/'
+        headers = {name.strip().lower(): value.strip() for name, _, value in (line.partition(':') for line in lines[1:])}
+
+        # -- Traktor sends SOURCE like Icecast 1 did, newer sources send PUT.
+        if method not in ('SOURCE', 'PUT'):
+            self.answer(b'HTTP/1.0 405 Method Not Allowed\r\n\r\n', close=True)
+            return None
+
+        if headers.get('expect', '').lower() == '100-continue':
+            self.answer(b'HTTP/1.1 100 Continue\r\n\r\n')
+
+        self.answer(b'HTTP/1.0 200 OK\r\n\r\n')
+
+        print(f'Traktor connected on port {self.port} ({mount}).')
+
+        self.parser = OggCommentParser(self.server.handle_metadata)
+        return rest
+
+    def answer(self, response, close=False):
+        self.transport.write(response)
+
+        if close:
+            self.transport.close()
+
+    def connection_lost(self, exc):
+        self.server.connections.discard(self)
+
+        if self.parser is not None:
+            print(f'Traktor disconnected from port {self.port}.')
+
+
+class IcecastIngestServer:
+    """Accept Traktor broadcasts on one or more ports and pass on the track info they carry.
+
+    Every source feeds the same on_metadata(data) callback, with data a list of
+    (key, value) tuples like traktor_nowplaying's listener gave us. It is called on the
+    event loop, one source at a time.
+    """
+
+    def __init__(self, ports, on_metadata, address=None):
+        """Initialize the server. By default we listen on every interface."""
+
+        self.ports = ports
+        self.on_metadata = on_metadata
+        self.address = address
+        self.connections = set()
+
+    def handle_metadata(self, data):
+        try:
+            self.on_metadata(data)
+        except Exception as e:
+            print(f'Error handling Traktor metadata: {e}')
+
+    async def serve_forever(self):
+        loop = asyncio.get_running_loop()
+        servers = []
+
+        try:
+            for port in self.ports:
+                servers.append(await loop.create_server(partial(IcecastSourceProtocol, self, port), self.address, port))
+
+            print(f'Listening to Traktor on port{"s" if len(self.ports) > 1 else ""} '
+                  f'{", ".join(str(port) for port in self.ports)}...')
+
+            await asyncio.gather(*(server.serve_forever() for server in servers))
+        finally:
+            for server in servers:
+                server.close()
+
+            for connection in list(self.connections):
+                connection.transport.close()
@@ -19,10 +19,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-import os
-import magic
-
-from mastodon import Mastodon
+from mastodon import Mastodon, MastodonAPIError, MastodonIllegalArgumentError, MastodonRatelimitError, MastodonServerError
+from mediacache import MediaCache
 
 
 # -- Classes
@@ -38,65 +36,66 @@ class MastodonClient:
         self.stream_stop_text = posts['StreamStopText']
         self.track_update_text = posts['TrackUpdateText']
         self.track_update_no_label_text = posts['TrackUpdateNoLabelText']
-        self.last_toot_status_id = None
+        # -- Mastodon only lets a media attachment be used by one status, so this is off by default.
+        self.media_cache = MediaCache(int(config.get('MediaCacheLifetime', '0')))
 
+        # -- We want to know about rate limits instead of having Mastodon.py sleep until they reset.
         self.client = Mastodon(client_id=config['ClientID'],
                                client_secret=config['ClientSecret'],
                                access_token=config['AccessToken'],
-                               api_base_url=config['APIBaseURL'])
+                               api_base_url=config['APIBaseURL'],
+                               ratelimit_method='throw')
 
-    def toot(self, text, in_reply_to=None, media_filename=None):
-        """Toot some text."""
+    def send_status(self, text, in_reply_to=None, artwork=None):
+        """Toot some text and return the ID of the status, raising if anything goes wrong."""
 
-        if self.client is None:
-            return None
+        media_ids = None
+        using_cached_media = False
 
-        result = None
+        if artwork is not None:
+            media_id = self.media_cache.get(artwork.digest)
+            using_cached_media = media_id is not None
 
-        # -- Update the status
-        try:
-            media_ids = None
+            if not using_cached_media:
+                media_id = self.upload_media(artwork)
 
-            if media_filename is not None and os.path.exists(media_filename):
-                mime = magic.Magic(mime=True)
-                mime_type = mime.from_file(media_filename)
+            media_ids = [media_id]
 
-                with open(media_filename, 'rb') as f:
-                    content = f.read()
-
-                    media = self.client.media_post(media_file=content,
-                                                   mime_type=mime_type,
-                                                   description="Cover art of the track currently playing.")
-                    media_ids = [media["id"]]
+        try:
+            result = self.client.status_post(text,
+                                             in_reply_to_id=in_reply_to,
+                                             media_ids=media_ids)
+        except MastodonRatelimitError:
+            raise
+        except Exception:
+            if not using_cached_media:
+                raise
 
-                    f.close()
+            # -- The media we uploaded earlier may not be valid anymore, upload it again.
+            self.media_cache.remove(artwork.digest)
+            media_ids = [self.upload_media(artwork)]
 
             result = self.client.status_post(text,
                                              in_reply_to_id=in_reply_to,
                                              media_ids=media_ids)
 
-            print(f'Toot!: {text}')
-        except Exception as e:
-            print(f'Error tooting!: {text}')
-            print(f'-=> {e}')
-            return None
+        print(f'Toot!: {text}')
 
         return result["id"]
 
-    def post_start_text(self):
-        """Toot the stream start text."""
-        self.last_toot_status_id = self.toot(self.stream_start_text)
+    def upload_media(self, artwork):
+        media = self.client.media_post(media_file=artwork.data,
+                                       mime_type=artwork.mime_type,
+                                       description="Cover art of the track currently playing.")
+        self.media_cache.add(artwork.digest, media["id"])
 
-    def post_stop_text(self):
-        """Toot the stream stop text."""
-        self.toot(self.stream_stop_text, in_reply_to=self.last_toot_status_id)
-        self.last_toot_status_id = None
+        return media["id"]
 
-    def post_status(self, title, artist, label=None, artwork_filename=None):
-        """Toot the currently playing track."""
+    def status_text(self, title, artist, label=None):
+        """Return the text of the status for a track or None if there is nothing to post."""
 
         if len(title) == 0 or len(artist) == 0:
-            return
+            return None
 
         if label is None or len(label) == 0:
             update_message = self.track_update_no_label_text.replace('{title}', title)
@@ -106,6 +105,22 @@ class MastodonClient:
             update_message = update_message.replace('{artist}', artist)
             update_message = update_message.replace('{label}', label)
 
-        self.last_toot_status_id = self.toot(text=update_message,
-                                             media_filename=artwork_filename,
-                                             in_reply_to=self.last_toot_status_id)
+        return update_message
+
+    @staticmethod
+    def is_permanent_error(error):
+        """Return True if posting again would fail the same way."""
+
+        if isinstance(error, MastodonIllegalArgumentError):
+            return True
+
+        # -- Anything the server rejected, except for its own errors, won't get better by trying again.
+        return isinstance(error, MastodonAPIError) and not isinstance(error, MastodonServerError)
+
+    def rate_limit_reset_time(self, error):
+        """Return the time at which we can post again if error is a rate limit, None otherwise."""
+
+        if not isinstance(error, MastodonRatelimitError):
+            return None
+
+        return float(self.client.ratelimit_reset)
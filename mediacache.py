@@ -0,0 +1,62 @@
+#
+# MediaCache
+# Copyright 2021-2022 by Didier Malenfant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from time import monotonic
+
+
+# -- Classes
+class MediaCache:
+    """Remember the remote ID of media we already uploaded, keyed by the digest of its content."""
+
+    def __init__(self, lifetime):
+        """Initialize the cache. IDs are forgotten after lifetime seconds, 0 disables the cache."""
+
+        self.lifetime = lifetime
+        self.media_ids = {}
+
+    def get(self, digest):
+        """Return the media ID uploaded for digest or None if there isn't a valid one."""
+
+        entry = self.media_ids.get(digest, None)
+        if entry is None:
+            return None
+
+        media_id, expiry_time = entry
+        if monotonic() >= expiry_time:
+            del self.media_ids[digest]
+            return None
+
+        return media_id
+
+    def add(self, digest, media_id, lifetime=None):
+        if lifetime is None:
+            lifetime = self.lifetime
+
+        if lifetime <= 0:
+            return
+
+        now = monotonic()
+
+        # -- Drop expired entries so the cache doesn't grow for the whole set.
+        for expired_digest in [key for key, entry in self.media_ids.items() if entry[1] <= now]:
+            del self.media_ids[expired_digest]
+
+        self.media_ids[digest] = (media_id, now + lifetime)
+
+    def remove(self, digest):
+        self.media_ids.pop(digest, None)
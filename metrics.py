@@ -0,0 +1,274 @@
+#
+# Metrics
+# Copyright 2021-2022 by Didier Malenfant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import bisect
+
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import monotonic
+
+
+# -- Functions
+def histogram(name, help_text):
+    """Return the histogram called name, creating it if needed."""
+
+    return default_metrics.metric(Histogram, name, help_text)
+
+
+def counter(name, help_text):
+    """Return the counter called name, creating it if needed."""
+
+    return default_metrics.metric(Counter, name, help_text)
+
+
+def format_labels(labels, extra_label=None):
+    pairs = list(labels)
+    if extra_label is not None:
+        pairs.append(extra_label)
+
+    if len(pairs) == 0:
+        return ''
+
+    escaped_pairs = []
+    for name, value in pairs:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped_pairs.append(f'{name}="{value}"')
+
+    return '{' + ','.join(escaped_pairs) + '}'
+
+
+def format_seconds(seconds):
+    return f'{seconds * 1000:.1f}ms'
+
+
+# -- Classes
+class Counter:
+    """Count of events, per set of label values."""
+
+    TYPE = 'counter'
+
+    def __init__(self, name, help_text):
+        """Initialize an empty counter."""
+
+        self.name = name
+        self.help_text = help_text
+        self.lock = Lock()
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def prometheus_lines(self):
+        with self.lock:
+            values = list(self.values.items())
+
+        return [f'{self.name}{format_labels(key)} {value}' for key, value in values]
+
+    def summary_lines(self):
+        with self.lock:
+            values = list(self.values.items())
+
+        return [f'{self.name}{format_labels(key)}: {value}' for key, value in values]
+
+
+class Histogram:
+    """Distribution of durations in seconds, per set of label values.
+
+    Observations go in fixed buckets, like Prometheus histograms, so recording one
+    costs the same however many we already have. We also keep the smallest and
+    largest ones exactly.
+    """
+
+    TYPE = 'histogram'
+    BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, name, help_text):
+        """Initialize an empty histogram."""
+
+        self.name = name
+        self.help_text = help_text
+        self.lock = Lock()
+        self.series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        bucket_index = bisect.bisect_left(Histogram.BUCKETS, value)
+
+        with self.lock:
+            series = self.series.get(key, None)
+            if series is None:
+                # -- Bucket counts, including one past the last bucket, then the count, sum, max and min.
+                series = [[0] * (len(Histogram.BUCKETS) + 1), 0, 0.0, value, value]
+                self.series[key] = series
+
+            series[0][bucket_index] += 1
+            series[1] += 1
+            series[2] += value
+            series[3] = max(series[3], value)
+            series[4] = min(series[4], value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the body of a with statement takes."""
+
+        start_time = monotonic()
+
+        try:
+            yield
+        finally:
+            self.observe(monotonic() - start_time, **labels)
+
+    def snapshot(self):
+        with self.lock:
+            return [(key, list(buckets), count, total, maximum, minimum)
+                    for key, (buckets, count, total, maximum, minimum) in self.series.items()]
+
+    @staticmethod
+    def quantile(buckets, count, maximum, minimum, fraction):
+        """Estimate a quantile by interpolating within the bucket it falls in, like Prometheus' histogram_quantile().
+
+        Buckets are narrowed down to the smallest and largest values we observed.
+        """
+
+        rank = fraction * count
+        cumulative_count = 0
+
+        for index, bucket_count in enumerate(buckets):
+            if bucket_count != 0 and cumulative_count + bucket_count >= rank:
+                lower_bound = minimum if index == 0 else max(Histogram.BUCKETS[index - 1], minimum)
+                upper_bound = maximum if index == len(Histogram.BUCKETS) else min(Histogram.BUCKETS[index], maximum)
+
+                return lower_bound + (upper_bound - lower_bound) * (rank - cumulative_count) / bucket_count
+
+            cumulative_count += bucket_count
+
+        return maximum
+
+    def prometheus_lines(self):
+        lines = []
+
+        for key, buckets, count, total, _, _ in self.snapshot():
+            cumulative_count = 0
+
+            for upper_bound, bucket_count in zip(Histogram.BUCKETS, buckets):
+                cumulative_count += bucket_count
+                lines.append(f'{self.name}_bucket{format_labels(key, ("le", upper_bound))} {cumulative_count}')
+
+            lines.append(f'{self.name}_bucket{format_labels(key, ("le", "+Inf"))} {count}')
+            lines.append(f'{self.name}_sum{format_labels(key)} {total}')
+            lines.append(f'{self.name}_count{format_labels(key)} {count}')
+
+        return lines
+
+    def summary_lines(self):
+        lines = []
+
+        for key, buckets, count, total, maximum, minimum in self.snapshot():
+            lines.append(f'{self.name}{format_labels(key)}: {count} times, '
+                         f'{format_seconds(total / count)} average, '
+                         f'{format_seconds(Histogram.quantile(buckets, count, maximum, minimum, 0.5))} median, '
+                         f'{format_seconds(Histogram.quantile(buckets, count, maximum, minimum, 0.95))} 95th percentile, '
+                         f'{format_seconds(maximum)} max.')
+
+        return lines
+
+
+class Metrics:
+    """All our counters and histograms."""
+
+    def __init__(self):
+        """Initialize an empty set of metrics."""
+
+        self.lock = Lock()
+        self.metrics = {}
+
+    def metric(self, metric_class, name, help_text):
+        with self.lock:
+            metric = self.metrics.get(name, None)
+            if metric is None:
+                metric = metric_class(name, help_text)
+                self.metrics[name] = metric
+
+        return metric
+
+    def prometheus_text(self):
+        """Return all our metrics in the Prometheus text exposition format."""
+
+        with self.lock:
+            metrics = list(self.metrics.values())
+
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help_text}')
+            lines.append(f'# TYPE {metric.name} {metric.TYPE}')
+            lines.extend(metric.prometheus_lines())
+
+        return '\n'.join(lines) + '\n'
+
+    def print_summary(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+
+        for metric in metrics:
+            for line in metric.summary_lines():
+                print(line)
+
+
+class MetricsServer:
+    """Serve our metrics over HTTP for Prometheus to scrape, from a background thread."""
+
+    def __init__(self, port, address='127.0.0.1', metrics=None):
+        """Initialize the server and start serving. By default we only listen on localhost."""
+
+        served_metrics = default_metrics if metrics is None else metrics
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+
+                body = served_metrics.prometheus_text().encode('utf-8')
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((address, port), MetricsHandler)
+        self.server.daemon_threads = True
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+
+        self.thread.start()
+
+        print(f'Serving metrics on http://{address}:{port}/metrics')
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+default_metrics = Metrics()
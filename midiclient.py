@@ -19,7 +19,9 @@
 import mido
 import sys
 
-from time import sleep
+from midioutput import MidiOutput
+from time import monotonic, sleep
+from workqueue import WorkQueue
 
 
 # -- Functions
@@ -34,13 +36,20 @@ def on_listening_midi_msg(message):
 class MidiClient:
     """Manage all our Midi interactions."""
 
-    def __init__(self, config):
-        """Initialize the client based on user configuration."""
+    def __init__(self, config, new_work_queue=WorkQueue, recorder=None):
+        """Initialize the client based on user configuration.
+
+        new_work_queue(name) creates the queue each subsystem's callbacks run on. If
+        recorder is a SessionRecorder, the notes we receive are recorded with it.
+        """
 
         print('Setting up midi...')
 
         self.midi_input = None
         self.midi_output = None
+        self.output = None
+        self.new_work_queue = new_work_queue
+        self.recorder = recorder
 
         input_device_name = config['InputDeviceName']
         if input_device_name is not None:
@@ -58,54 +67,63 @@ class MidiClient:
             for device_name in mido.get_output_names():
                 if device_name == output_device_name:
                     self.midi_output = mido.open_output(device_name)
+                    self.output = MidiOutput(self.midi_output, int(config.get('OutputMessagesPerSecond', '500')))
                     print(f'Output: {device_name}')
                     break
 
         if self.midi_output is None:
             print(f'Can\'t open midi output device {output_device_name}')
 
-        self.notes_currently_on = []
         self.note_on_callbacks = {}
+        self.work_queues = {}
+
+    def add_callback(self, channel, note, callback, subsystem='midi'):
+        """Call callback(channel, note) on the worker for subsystem when note is pressed."""
+
+        work_queue = self.work_queues.get(subsystem, None)
+        if work_queue is None:
+            work_queue = self.new_work_queue(subsystem)
+            self.work_queues[subsystem] = work_queue
 
-    def add_callback(self, channel, note, callback):
         existing_callbacks_for_channel = self.note_on_callbacks.get(channel, {})
 
-        existing_callbacks_for_channel[note] = callback
+        label = f'channel {channel + 1} note {note}'
+        existing_callbacks_for_channel[note] = (work_queue, label, callback)
         self.note_on_callbacks[channel] = existing_callbacks_for_channel
 
     def on_midi_msg(self, message):
+        # -- This runs on mido's input thread so we only route the message, callbacks run on their subsystem's worker.
+        received_time = monotonic()
+
         if(message.type != 'note_on'):
             return
 
+        if self.recorder is not None:
+            self.recorder.record('midi', message.type, {'channel': message.channel, 'note': message.note,
+                                                        'velocity': message.velocity})
+
         existing_callbacks_for_channel = self.note_on_callbacks.get(message.channel, None)
         if existing_callbacks_for_channel is None:
             return
 
-        callback = existing_callbacks_for_channel.get(message.note, None)
-        if callback is None:
+        mapping = existing_callbacks_for_channel.get(message.note, None)
+        if mapping is None:
             return
 
-        callback(message.channel, message.note)
+        work_queue, label, callback = mapping
+        work_queue.put(label, callback, message.channel, message.note, queued_time=received_time)
 
     def note_on(self, note, channel, velocity):
-        if self.midi_output is None:
+        if self.output is None:
             return
 
-        self.midi_output.send(mido.Message('note_on', channel=channel, note=note, velocity=velocity))
-
-        note_channel_combo = [note, channel]
-        if note_channel_combo not in self.notes_currently_on:
-            self.notes_currently_on.append(note_channel_combo)
+        self.output.set_note(note, channel, velocity)
 
     def note_off(self, note, channel):
-        if self.midi_output is None:
+        if self.output is None:
             return
 
-        self.midi_output.send(mido.Message('note_off', channel=channel, note=note))
-
-        note_channel_combo = [note, channel]
-        if note_channel_combo in self.notes_currently_on:
-            self.notes_currently_on.remove(note_channel_combo)
+        self.output.set_note(note, channel)
 
     def shutdown(self):
         print('Shutting down midi...')
@@ -113,13 +131,17 @@ class MidiClient:
         if self.midi_input is not None:
             self.midi_input.close()
 
-        if self.midi_output is not None:
-            for note_channel_combo in self.notes_currently_on:
-                self.note_off(note_channel_combo[0], note_channel_combo[1])
+        for work_queue in self.work_queues.values():
+            work_queue.stop()
+
+        # -- All the queues share the same second to finish, instead of getting one each.
+        deadline = monotonic() + 1
 
-                # -- Give some time for the note off to be sent thru
-                sleep(5)
+        for work_queue in self.work_queues.values():
+            work_queue.wait_until_stopped(max(deadline - monotonic(), 0))
 
+        if self.midi_output is not None:
+            self.output.shutdown()
             self.midi_output.close()
 
     @staticmethod
@@ -0,0 +1,139 @@
+#
+# MidiOutput
+# Copyright 2021-2022 by Didier Malenfant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import mido
+
+from collections import OrderedDict
+from metrics import histogram
+from threading import Condition, Thread
+from time import monotonic, sleep
+
+# -- Note states are stored as one byte per channel and note: 0 is off, 1 to 128 is on with a velocity
+# -- of 0 to 127 and UNKNOWN means we don't know what the device is showing yet.
+NOTE_OFF = 0
+UNKNOWN = 255
+
+# -- Time it takes a 3 byte message to go through a 31250 baud midi cable.
+MESSAGE_TRANSMIT_TIME = 3 * 10 / 31250
+
+OUTPUT_LATENCY = histogram('streammanager_midi_output_latency_seconds', 'Time between a note changing and it being sent.')
+
+
+# -- Classes
+class MidiOutput:
+    """Keep the state of the notes we want lit on a midi output and send only what changes.
+
+    Changes are sent from a background thread, at most max_messages_per_second of them.
+    A note that changes several times before it is sent only sends its last state, or
+    nothing if it went back to what the device already shows.
+    """
+
+    def __init__(self, port, max_messages_per_second=500):
+        """Initialize the output for a mido output port."""
+
+        self.port = port
+        self.message_interval = 1.0 / max_messages_per_second
+        self.wanted_states = bytearray(16 * 128)
+        self.sent_states = bytearray([UNKNOWN]) * (16 * 128)
+        self.changed_notes = OrderedDict()
+        self.condition = Condition()
+        self.running = True
+        self.worker = Thread(target=self.send_changes, daemon=True)
+
+        self.worker.start()
+
+    def set_note(self, note, channel, velocity=None):
+        """Set a note on with velocity or off if velocity is None."""
+
+        index = channel * 128 + note
+        state = NOTE_OFF if velocity is None else velocity + 1
+
+        with self.condition:
+            if self.wanted_states[index] == state and (index in self.changed_notes or self.sent_states[index] == state):
+                return
+
+            self.wanted_states[index] = state
+            self.changed_notes.setdefault(index, monotonic())
+            self.condition.notify()
+
+    def send_changes(self):
+        next_send_time = monotonic()
+
+        while True:
+            # -- Wait for our turn before picking a change so that anything arriving meanwhile is coalesced.
+            delay = next_send_time - monotonic()
+            if delay > 0:
+                sleep(delay)
+
+            with self.condition:
+                while self.running and len(self.changed_notes) == 0:
+                    self.condition.wait()
+
+                if not self.running:
+                    return
+
+                index, changed_time = self.changed_notes.popitem(last=False)
+                state = self.wanted_states[index]
+
+                if state == self.sent_states[index]:
+                    continue
+
+                self.sent_states[index] = state
+
+            channel = index // 128
+            note = index % 128
+
+            if state == NOTE_OFF:
+                self.send(mido.Message('note_off', channel=channel, note=note))
+            else:
+                self.send(mido.Message('note_on', channel=channel, note=note, velocity=state - 1))
+
+            now = monotonic()
+            OUTPUT_LATENCY.observe(now - changed_time)
+
+            next_send_time = now + self.message_interval
+
+    def send(self, message):
+        try:
+            self.port.send(message)
+        except Exception as e:
+            print(f'Error sending midi message: {e}')
+
+    def shutdown(self, timeout=0.5):
+        """Turn off every note the device is showing in one go and give the messages at most timeout seconds to go through."""
+
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+        self.worker.join(timeout)
+
+        with self.condition:
+            lit_notes = [index for index, state in enumerate(self.sent_states) if state != NOTE_OFF and state != UNKNOWN]
+
+            for index in lit_notes:
+                self.wanted_states[index] = NOTE_OFF
+                self.sent_states[index] = NOTE_OFF
+
+            self.changed_notes.clear()
+
+        for index in lit_notes:
+            self.send(mido.Message('note_off', channel=index // 128, note=index % 128))
+
+        # -- Ports don't tell us when they are done sending so we wait for as long as a midi cable would take.
+        sleep(min(timeout, len(lit_notes) * MESSAGE_TRANSMIT_TIME))
@@ -20,20 +20,28 @@ import obswebsocket
 import obswebsocket.events
 import obswebsocket.requests
 
-from threading import Thread
+from obsconnection import OBSConnection
+from obsstate import OBSState
+from workqueue import WorkQueue
 
 
 # -- Classes
 class OBSClient:
     """Manage all our OBS interactions."""
 
-    def __init__(self, config, midi_client, post_clients):
-        """Initialize the client based on user configuration."""
+    def __init__(self, config, midi_client, post_clients, new_work_queue=WorkQueue, new_connection=OBSConnection,
+                 recorder=None):
+        """Initialize the client based on user configuration.
+
+        new_work_queue(name) creates the queue OBS events are handled on and new_connection
+        the connection to OBS. If recorder is a SessionRecorder, OBS events are recorded with it.
+        """
 
         print('Setting up OBS...')
 
         self.midi_client = midi_client
         self.post_clients = post_clients
+        self.recorder = recorder
         self.server_address = config['ObsServerAddress']
         self.server_port = int(config['ObsServerPort'])
         self.server_password = config['ObsServerPassword']
@@ -47,7 +55,7 @@ class OBSClient:
             self.scene_selection_notes.append(note)
 
             self.midi_client.add_callback(self.current_scene_channel, note,
-                                          self.set_current_scene)
+                                          self.set_current_scene, 'obs')
 
         self.stream_status_note = int(config['StreamStatusNote'])
         self.stream_status_channel = int(config['StreamStatusChannel']) - 1
@@ -56,54 +64,91 @@ class OBSClient:
 
         self.midi_client.add_callback(self.stream_status_channel,
                                       self.stream_status_note,
-                                      self.toggle_stream_status)
+                                      self.toggle_stream_status, 'obs')
 
-        self.obs = obswebsocket.obsws(self.server_address, self.server_port, self.server_password)
-        self.obs.register(self.on_transition, obswebsocket.events.TransitionBegin)
-        self.obs.register(self.on_scene_changed, obswebsocket.events.TransitionEnd)
-        self.obs.register(self.on_stream_started, obswebsocket.events.StreamStarted)
-        self.obs.register(self.on_stream_stopped, obswebsocket.events.StreamStopped)
+        self.state = OBSState()
+        self.events = new_work_queue('obs events')
 
-        try:
-            self.obs.connect()
-        except obswebsocket.exceptions.ConnectionFailure:
-            self.obs = None
+        # -- Events arrive on the websocket's thread, we handle them in order on our own worker.
+        self.connection = new_connection(self.server_address, self.server_port, self.server_password,
+                                        on_connected=lambda: self.events.put('sync', self.on_connected))
+
+        self.register_event(self.on_transition_begin, obswebsocket.events.TransitionBegin)
+        self.register_event(self.on_transition_end, obswebsocket.events.TransitionEnd)
+        self.register_event(self.on_switch_scenes, obswebsocket.events.SwitchScenes)
+        self.register_event(self.on_scenes_changed, obswebsocket.events.ScenesChanged)
+        self.register_event(self.on_stream_started, obswebsocket.events.StreamStarted)
+        self.register_event(self.on_stream_stopped, obswebsocket.events.StreamStopped)
+
+    def register_event(self, handler, event):
+        label = event.__name__
+        self.connection.register(lambda message: self.queue_event(label, handler, message), event)
+
+    def queue_event(self, label, handler, message):
+        if self.recorder is not None:
+            self.recorder.record('obs', label, message.datain)
+
+        self.events.put(label, handler, message)
+
+    def on_connected(self):
+        # -- A transition that was running when we lost OBS will never send us its end.
+        self.state.in_transition = False
+
+        self.sync_state()
+
+    def sync_state(self):
+        # -- The scene list also tells us the current scene so we don't need to ask for it separately.
+        answers = self.connection.call_batch([obswebsocket.requests.GetSceneList(),
+                                              obswebsocket.requests.GetStreamingStatus()])
+
+        if (answers is None or not all(answer.status for answer in answers)) and self.connection.connected:
+            # -- obs-websocket before 4.9 doesn't know ExecuteBatch, so we send both requests before waiting on either.
+            requests = [obswebsocket.requests.GetSceneList(), obswebsocket.requests.GetStreamingStatus()]
+            futures = [self.connection.submit(request) for request in requests]
+            answers = [self.connection.wait_for(future, request.name) for future, request in zip(futures, requests)]
+
+        if answers is None:
             return
 
-        # -- Get all the scenes
-        all_scenes = self.obs.call(obswebsocket.requests.GetSceneList())
+        all_scenes, status = answers
 
-        self.scenes = []
-        for scene in all_scenes.getScenes():
-            self.scenes.append(scene['name'])
+        if all_scenes is not None and all_scenes.status:
+            self.state.set_scenes(scene['name'] for scene in all_scenes.getScenes())
+            self.update_current_scene(all_scenes.getCurrentScene(), force_note_update=True)
 
-        # -- Update the current scene
-        self.update_current_scene_index()
-        self.set_current_scene_note(True)
+        if status is not None and status.status:
+            self.state.stream_on = status.getStreaming()
+            self.update_stream_status_note()
 
-        # -- Update the initial stream status
-        status = self.obs.call(obswebsocket.requests.GetStreamingStatus())
-        self.stream_on = status.getStreaming()
+    def update_current_scene(self, scene_name, force_note_update=False):
+        previous_scene_index = self.state.current_scene_index
 
-        self.in_transition = False
+        self.state.set_current_scene(scene_name)
 
-        self.update_stream_status_note()
+        self.update_scene_notes(previous_scene_index, force_note_update)
 
-    def update_current_scene_index(self):
-        current_scene = self.obs.call(obswebsocket.requests.GetCurrentScene())
-        self.current_scene_index = self.scenes.index(current_scene.getName())
+    def update_scene_notes(self, previous_scene_index, force_note_update=False):
+        scene_index = self.state.current_scene_index
+        if scene_index == previous_scene_index and not force_note_update:
+            return
+
+        self.set_scene_note(previous_scene_index, False)
+        self.set_scene_note(scene_index, True)
+
+    def set_scene_note(self, scene_index, on_or_off):
+        if scene_index is None or scene_index >= len(self.scene_selection_notes):
+            return
 
-    def set_current_scene_note(self, on_or_off):
         if on_or_off:
             self.midi_client.note_on(channel=self.current_scene_channel,
-                                     note=self.scene_selection_notes[self.current_scene_index],
+                                     note=self.scene_selection_notes[scene_index],
                                      velocity=self.current_scene_velocity)
         else:
             self.midi_client.note_off(channel=self.current_scene_channel,
-                                      note=self.scene_selection_notes[self.current_scene_index])
+                                      note=self.scene_selection_notes[scene_index])
 
     def update_stream_status_note(self):
-        if self.stream_on:
+        if self.state.stream_on:
             self.midi_client.note_on(channel=self.stream_status_channel, note=self.stream_status_note,
                                      velocity=self.stream_status_on_velocity)
         else:
@@ -112,43 +157,57 @@ class OBSClient:
 
     def start_streaming(self):
         print('Set Stream ON')
-        self.obs.call(obswebsocket.requests.StartStreaming())
+        self.connection.submit(obswebsocket.requests.StartStreaming())
 
     def stop_streaming(self):
         print('Set Stream OFF')
-        self.obs.call(obswebsocket.requests.StopStreaming())
+        self.connection.submit(obswebsocket.requests.StopStreaming())
 
     def toggle_stream_status(self, channel, note):
-        if self.stream_on:
+        if self.state.stream_on:
             self.stop_streaming()
         else:
             self.start_streaming()
 
     def set_current_scene(self, channel, note):
-        if self.in_transition:
+        if self.state.in_transition:
             return
 
-        scene_index = self.scene_selection_notes.index(note)
-        if scene_index >= len(self.scenes):
+        scene_name = self.state.scene_at(self.scene_selection_notes.index(note))
+        if scene_name is None:
             return
 
-        self.obs.call(obswebsocket.requests.SetCurrentScene(self.scenes[scene_index]))
+        self.connection.submit(obswebsocket.requests.SetCurrentScene(scene_name))
+
+    def on_transition_begin(self, message):
+        self.state.in_transition = True
 
-    def on_transition(self, message):
-        self.in_transition = True
+    def on_transition_end(self, message):
+        # -- The getters raise KeyError for anything the event doesn't carry, like to-scene in older versions of OBS.
+        try:
+            self.update_current_scene(message.datain.get('to-scene'))
+        finally:
+            self.state.in_transition = False
+
+    def on_switch_scenes(self, message):
+        # -- Cuts don't send transition events so this is the only way we hear about them.
+        self.update_current_scene(message.getSceneName())
+
+    def on_scenes_changed(self, message):
+        scenes = message.datain.get('scenes')
+        if scenes is None:
+            # -- Older versions of obs-websocket don't include the new list in the event.
+            self.sync_state()
+            return
 
-    def do_obs_scene_changed(self):
-        self.set_current_scene_note(False)
-        self.update_current_scene_index()
-        self.set_current_scene_note(True)
+        previous_scene_index = self.state.current_scene_index
 
-        self.in_transition = False
+        self.state.set_scenes(scene['name'] for scene in scenes)
 
-    def on_scene_changed(self, message):
-        Thread(target=self.do_obs_scene_changed).start()
+        self.update_scene_notes(previous_scene_index)
 
     def on_stream_started(self, message):
-        self.stream_on = True
+        self.state.stream_on = True
 
         self.update_stream_status_note()
 
@@ -158,7 +217,7 @@ class OBSClient:
         return
 
     def on_stream_stopped(self, message):
-        self.stream_on = False
+        self.state.stream_on = False
 
         self.update_stream_status_note()
 
@@ -170,7 +229,7 @@ class OBSClient:
     def shutdown(self):
         print('Shutting down obs...')
 
-        if self.obs is not None:
-            self.obs.disconnect()
+        self.connection.shutdown()
 
-            self.obs = None
+        self.events.stop()
+        self.events.wait_until_stopped(1)
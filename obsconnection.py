@@ -0,0 +1,255 @@
+#
+# OBSConnection
+# Copyright 2021-2022 by Didier Malenfant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import json
+import obswebsocket
+import random
+
+from concurrent.futures import Future, TimeoutError
+from metrics import counter, histogram
+from threading import Event, Lock, Thread
+from time import monotonic
+
+REQUEST_DURATION = histogram('streammanager_obs_request_seconds', 'Time between sending a request to OBS and getting its answer.')
+REJECTED_REQUESTS = counter('streammanager_obs_rejected_requests_total', 'Requests we couldn\'t send to OBS.')
+CONNECTIONS = counter('streammanager_obs_connections_total', 'Connections made to OBS, including reconnections.')
+
+
+# -- Classes
+class OBSAnswers(dict):
+    """Stand-in for obsws' answers dict that hands the answers we are waiting on to their future."""
+
+    def __init__(self, connection):
+        """Initialize the answers for connection."""
+
+        super().__init__()
+
+        self.connection = connection
+
+    def __setitem__(self, message_id, answer):
+        # -- This is called by obsws' receive thread for every answer it gets.
+        if not self.connection.resolve(message_id, answer):
+            super().__setitem__(message_id, answer)
+
+
+class OBSConnection:
+    """Keep a websocket connection to OBS open from a background thread.
+
+    Connecting never blocks the caller. If OBS isn't there or the connection drops, we
+    try again with exponential backoff and call on_connected each time we get it back
+    so the caller can resync what it missed. Requests made while disconnected are
+    rejected right away.
+
+    Requests are pipelined: submit() returns a future right away and any number of
+    requests can wait for their answer at the same time, matched by message ID.
+    """
+
+    # -- How long call() waits for an answer.
+    CALL_TIMEOUT = 10
+
+    FIRST_RETRY_DELAY = 1
+    MAX_RETRY_DELAY = 30
+
+    def __init__(self, address, port, password, on_connected=None):
+        """Initialize the connection and start connecting in the background."""
+
+        self.obs = obswebsocket.obsws(address, port, password)
+        self.obs.answers = OBSAnswers(self)
+        self.on_connected = on_connected
+        self.send_lock = Lock()
+        self.pending_requests = {}
+        self.connected = False
+        self.stopping = Event()
+        self.thread = Thread(target=self.maintain_connection, daemon=True)
+
+        self.thread.start()
+
+    def register(self, handler, event):
+        """Call handler(message) on the websocket's thread for each event. This survives reconnections."""
+
+        self.obs.register(handler, event)
+
+    def call(self, request):
+        """Send request and return it filled with the response, or None if we couldn't send it."""
+
+        return self.wait_for(self.submit(request), request.name)
+
+    def call_batch(self, requests):
+        """Send requests in one go and return the list of them filled with their response, or None if we couldn't send them."""
+
+        return self.wait_for(self.submit_batch(requests), 'ExecuteBatch')
+
+    def wait_for(self, future, name):
+        try:
+            return future.result(OBSConnection.CALL_TIMEOUT)
+        except TimeoutError:
+            print(f'OBS didn\'t answer {name} in time.')
+            return None
+
+    def submit(self, request):
+        """Send request and return a future for it filled with the response, or for None if we couldn't send it."""
+
+        return self.send_requests(request.data(), [request], False)
+
+    def submit_batch(self, requests):
+        """Send requests in one go and return a future for the list of them filled with their response.
+
+        The future's result is None if we couldn't send them. This needs obs-websocket 4.9 or later.
+        """
+
+        requests = list(requests)
+        batch = {'request-type': 'ExecuteBatch', 'abortOnFail': False,
+                 'requests': [dict(request.data(), **{'message-id': str(index)}) for index, request in enumerate(requests)]}
+
+        return self.send_requests(batch, requests, True)
+
+    def send_requests(self, payload, requests, is_batch):
+        future = Future()
+        name = payload['request-type']
+
+        if not self.connected:
+            print(f'OBS is not connected, ignoring {name}.')
+            REJECTED_REQUESTS.inc(request=name)
+
+            future.set_result(None)
+            return future
+
+        with self.send_lock:
+            message_id = str(self.obs.id)
+            self.obs.id += 1
+
+            payload['message-id'] = message_id
+            self.pending_requests[message_id] = (future, name, requests, is_batch, monotonic())
+
+            try:
+                self.obs.ws.send(json.dumps(payload))
+            except Exception as e:
+                print(f'Error sending {name} to OBS: {e}')
+                REJECTED_REQUESTS.inc(request=name)
+
+                del self.pending_requests[message_id]
+                future.set_result(None)
+
+        return future
+
+    def resolve(self, message_id, answer):
+        """Fill in the requests waiting on message_id with answer and return True, or False if nothing was waiting on it."""
+
+        with self.send_lock:
+            pending_request = self.pending_requests.pop(message_id, None)
+
+        if pending_request is None:
+            return False
+
+        future, name, requests, is_batch, sent_time = pending_request
+
+        REQUEST_DURATION.observe(monotonic() - sent_time, request=name)
+
+        if answer.get('status') != 'ok':
+            print(f'OBS {name} failed: {answer.get("error")}')
+            future.set_result(None)
+            return True
+
+        results = answer.get('results', []) if is_batch else [answer]
+        for request, result in zip(requests, results):
+            request.input(result)
+
+            if not request.status:
+                print(f'OBS {request.name} failed: {request.datain.get("error")}')
+
+        future.set_result(requests if is_batch else requests[0])
+        return True
+
+    def cancel_pending_requests(self):
+        with self.send_lock:
+            pending_requests = list(self.pending_requests.values())
+            self.pending_requests.clear()
+
+        for future, _, _, _, _ in pending_requests:
+            future.set_result(None)
+
+    def maintain_connection(self):
+        attempts = 0
+
+        while not self.stopping.is_set():
+            try:
+                self.obs.connect()
+            except Exception as e:
+                if attempts == 0:
+                    print(f'Can\'t connect to OBS ({e}), retrying in the background.')
+
+                attempts += 1
+
+                delay = min(OBSConnection.FIRST_RETRY_DELAY * 2 ** (attempts - 1), OBSConnection.MAX_RETRY_DELAY)
+                self.stopping.wait(delay * random.uniform(0.8, 1.2))
+                continue
+
+            attempts = 0
+
+            if self.stopping.is_set():
+                self.close()
+                break
+
+            print('Connected to OBS.')
+            self.wait_until_disconnected()
+
+            if not self.stopping.is_set():
+                print('Lost connection to OBS, reconnecting...')
+
+                self.close()
+
+    def wait_until_disconnected(self):
+        recv_thread = None
+
+        while not self.stopping.is_set():
+            # -- obsws tries to reconnect on its own from its receive thread, we resync if it manages to.
+            if self.obs.thread_recv is not recv_thread:
+                recv_thread = self.obs.thread_recv
+                if recv_thread is None or not recv_thread.is_alive():
+                    break
+
+                self.connected = True
+                CONNECTIONS.inc()
+
+                if self.on_connected is not None:
+                    self.on_connected()
+
+            recv_thread.join(1)
+            if not recv_thread.is_alive() and self.obs.thread_recv is recv_thread:
+                break
+
+        self.connected = False
+
+        # -- Whatever we were waiting on isn't coming, including what we sent before obsws reconnected on its own.
+        self.cancel_pending_requests()
+
+    def close(self):
+        try:
+            self.obs.disconnect()
+        except Exception:
+            # -- The connection may be half closed already, there's nothing else we can do about it.
+            pass
+
+    def shutdown(self, timeout=1):
+        self.stopping.set()
+        self.connected = False
+
+        self.close()
+        self.cancel_pending_requests()
+
+        self.thread.join(timeout)
@@ -0,0 +1,65 @@
+#
+# OBSState
+# Copyright 2021-2022 by Didier Malenfant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+# -- Classes
+class OBSState:
+    """Local copy of the OBS state we care about, kept up to date from websocket events.
+
+    Only one thread updates the state. Other threads can read it since the scene list
+    and its index are replaced, never modified in place.
+    """
+
+    def __init__(self):
+        """Initialize an empty state."""
+
+        self.scenes = []
+        self.scene_indices = {}
+        self.current_scene = None
+        self.stream_on = False
+        self.in_transition = False
+
+    @property
+    def current_scene_index(self):
+        """Index of the current scene in the scene list or None if we don't know it."""
+
+        return self.scene_indices.get(self.current_scene, None)
+
+    def scene_at(self, index):
+        scenes = self.scenes
+        if index >= len(scenes):
+            return None
+
+        return scenes[index]
+
+    def set_scenes(self, scene_names):
+        scenes = list(scene_names)
+        scene_indices = {}
+
+        for index, name in enumerate(scenes):
+            # -- OBS doesn't allow duplicate names but if we get some, the first one wins like list.index() would.
+            scene_indices.setdefault(name, index)
+
+        self.scenes, self.scene_indices = scenes, scene_indices
+
+    def set_current_scene(self, name):
+        # -- Some events don't always carry the scene name, in which case we keep what we had.
+        if name is None:
+            return
+
+        self.current_scene = name
@@ -0,0 +1,190 @@
+#
+# Outbox
+# Copyright 2021-2022 by Didier Malenfant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import sqlite3
+
+from artworkpayload import ArtworkPayload
+from threading import Lock
+from time import time
+
+
+# -- Classes
+class Outbox:
+    """SQLite journal of the posts we need to send, so that they survive a crash or a restart.
+
+    Each post remembers the post it replies to (its parent) in the outbox itself. The
+    remote status ID to reply to is only looked up when the post is sent, which lets
+    the reply thread rebuild itself as delayed posts go out.
+    """
+
+    # -- How long we keep posts that were sent or given up on, for their replies to find them.
+    KEEP_DONE_POSTS_FOR = 2 * 24 * 60 * 60
+
+    def __init__(self, path):
+        """Initialize the outbox stored at path."""
+
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+
+        with self.lock, self.connection:
+            # -- WAL without a sync on every commit survives a crash of the app, at a fraction of the cost.
+            self.connection.execute('PRAGMA journal_mode = WAL')
+            self.connection.execute('PRAGMA synchronous = NORMAL')
+
+            self.connection.execute('CREATE TABLE IF NOT EXISTS posts (id INTEGER PRIMARY KEY, client TEXT, kind TEXT, '
+                                    'text TEXT, artwork TEXT, parent INTEGER, status TEXT, remote_id TEXT, '
+                                    'attempts INTEGER, next_attempt REAL, created REAL)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS artwork (digest TEXT PRIMARY KEY, data BLOB)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS threads (client TEXT PRIMARY KEY, last_post INTEGER)')
+
+            # -- Posts we were sending when we stopped may or may not have gone out, we send them again.
+            self.connection.execute('UPDATE posts SET status = ? WHERE status = ?', ('pending', 'sending'))
+
+            self.connection.execute('DELETE FROM posts WHERE status != ? AND created < ?',
+                                    ('pending', time() - Outbox.KEEP_DONE_POSTS_FOR))
+            self.delete_unused_artwork()
+
+    def queue_post(self, client, kind, text, artwork=None, coalescing_window=0):
+        """Add a post for client and return its ID.
+
+        kind is 'start' to start a new thread, 'stop' to end the current one or 'track'
+        to add a post to it. A track post waits coalescing_window seconds before it can
+        be sent, during which a newer track post replaces it instead of being added.
+        Start and stop posts are never replaced, they make the track post they follow
+        due right away instead.
+        """
+
+        artwork_digest = None if artwork is None else artwork.digest
+
+        with self.lock, self.connection:
+            now = time()
+
+            if artwork is not None:
+                self.connection.execute('INSERT OR IGNORE INTO artwork VALUES (?, ?)', (artwork_digest, artwork.view))
+
+            row = self.connection.execute('SELECT last_post FROM threads WHERE client = ?', (client,)).fetchone()
+            last_post = None if row is None else row[0]
+
+            if kind == 'track':
+                if last_post is not None:
+                    cursor = self.connection.execute('UPDATE posts SET text = ?, artwork = ?, next_attempt = ?, created = ? '
+                                                     'WHERE id = ? AND kind = ? AND status = ? AND attempts = 0 '
+                                                     'AND next_attempt > ?',
+                                                     (text, artwork_digest, now + coalescing_window, now,
+                                                      last_post, 'track', 'pending', now))
+                    if cursor.rowcount != 0:
+                        self.delete_unused_artwork()
+                        return last_post
+            else:
+                self.release_coalesced_posts(client, now)
+
+            parent = None if kind == 'start' else last_post
+            next_attempt = now + coalescing_window if kind == 'track' else now
+
+            cursor = self.connection.execute('INSERT INTO posts (client, kind, text, artwork, parent, status, attempts, '
+                                             'next_attempt, created) VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?)',
+                                             (client, kind, text, artwork_digest, parent, 'pending', next_attempt, now))
+            post_id = cursor.lastrowid
+
+            self.connection.execute('INSERT OR REPLACE INTO threads VALUES (?, ?)',
+                                    (client, None if kind == 'stop' else post_id))
+
+        return post_id
+
+    def send_coalesced_posts_now(self, client):
+        with self.lock, self.connection:
+            self.release_coalesced_posts(client, time())
+
+    def release_coalesced_posts(self, client, now):
+        self.connection.execute('UPDATE posts SET next_attempt = ? WHERE client = ? AND kind = ? '
+                                'AND status = ? AND attempts = 0 AND next_attempt > ?',
+                                (now, client, 'track', 'pending', now))
+
+    def next_post(self, client):
+        """Return (id, kind, text, artwork digest, attempts, next attempt time, creation time) for the oldest pending post of client."""
+
+        with self.lock:
+            return self.connection.execute('SELECT id, kind, text, artwork, attempts, next_attempt, created FROM posts '
+                                           'WHERE client = ? AND status = ? ORDER BY id LIMIT 1',
+                                           (client, 'pending')).fetchone()
+
+    def pending_count(self, client):
+        """Return how many posts client still has to send."""
+
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM posts WHERE client = ? AND status IN (?, ?)',
+                                           (client, 'pending', 'sending')).fetchone()[0]
+
+    def claim_post(self, post_id):
+        """Mark a post that is due as being sent and return it, or None if it was changed in the meantime."""
+
+        with self.lock, self.connection:
+            cursor = self.connection.execute('UPDATE posts SET status = ? WHERE id = ? AND status = ? AND next_attempt <= ?',
+                                             ('sending', post_id, 'pending', time()))
+            if cursor.rowcount == 0:
+                return None
+
+            return self.connection.execute('SELECT id, kind, text, artwork, attempts, next_attempt, created FROM posts '
+                                           'WHERE id = ?', (post_id,)).fetchone()
+
+    def artwork(self, digest):
+        if digest is None:
+            return None
+
+        with self.lock:
+            row = self.connection.execute('SELECT data FROM artwork WHERE digest = ?', (digest,)).fetchone()
+
+        return None if row is None else ArtworkPayload(row[0])
+
+    def reply_to_id(self, post_id):
+        """Return the remote ID of the closest post that post_id replies to and that was sent."""
+
+        with self.lock:
+            parent = self.connection.execute('SELECT parent FROM posts WHERE id = ?', (post_id,)).fetchone()[0]
+
+            while parent is not None:
+                row = self.connection.execute('SELECT parent, status, remote_id FROM posts WHERE id = ?',
+                                              (parent,)).fetchone()
+                if row is None:
+                    return None
+
+                parent, status, remote_id = row
+                if status == 'sent':
+                    return remote_id
+
+        return None
+
+    def mark_sent(self, post_id, remote_id):
+        self.set_status(post_id, 'sent', remote_id)
+
+    def mark_failed(self, post_id):
+        self.set_status(post_id, 'failed', None)
+
+    def set_status(self, post_id, status, remote_id):
+        with self.lock, self.connection:
+            self.connection.execute('UPDATE posts SET status = ?, remote_id = ? WHERE id = ?', (status, remote_id, post_id))
+            self.delete_unused_artwork()
+
+    def reschedule(self, post_id, next_attempt, attempts):
+        with self.lock, self.connection:
+            self.connection.execute('UPDATE posts SET status = ?, next_attempt = ?, attempts = ? WHERE id = ?',
+                                    ('pending', next_attempt, attempts, post_id))
+
+    def delete_unused_artwork(self):
+        self.connection.execute('DELETE FROM artwork WHERE digest NOT IN (SELECT artwork FROM posts '
+                                'WHERE status IN (?, ?) AND artwork IS NOT NULL)', ('pending', 'sending'))
@@ -0,0 +1,133 @@
+#
+# OverlayWriter
+# Copyright 2021-2022 by Didier Malenfant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import hashlib
+import os
+import shutil
+
+from threading import Lock
+
+
+# -- Classes
+class OverlayWriter:
+    """Write the files read by OBS for the stream overlay.
+
+    Files are only written when their content changes and always replaced atomically
+    (write to a temporary file then rename it) so OBS never reads a partial file. Since
+    a file is never modified in place, a placeholder image can be hard linked instead
+    of copied.
+    """
+
+    def __init__(self):
+        """Initialize the writer."""
+
+        self.last_written = {}
+        self.lock = Lock()
+
+    @staticmethod
+    def temporary_path(path):
+        return f'{path}.tmp'
+
+    def write_text(self, path, text):
+        """Write text to path if it is different from what we last wrote there."""
+
+        return self.write_bytes(path, text.encode('utf-8'))
+
+    def write_bytes(self, path, data):
+        """Write data to path if it is different from what we last wrote there."""
+
+        state = ('data', hashlib.sha1(data).digest())
+
+        with self.lock:
+            if self.last_written.get(path, None) == state:
+                return False
+
+            temporary_path = OverlayWriter.temporary_path(path)
+
+            try:
+                with open(temporary_path, 'wb') as file:
+                    file.write(data)
+
+                os.replace(temporary_path, path)
+            except OSError as e:
+                print(f'Error writing {path}: {e}')
+                self.last_written.pop(path, None)
+                return False
+
+            self.last_written[path] = state
+
+        return True
+
+    def link_file(self, path, source_path):
+        """Make path have the same content as source_path, unless it already does."""
+
+        try:
+            source_stat = os.stat(source_path)
+        except OSError as e:
+            print(f'Error reading {source_path}: {e}')
+            return False
+
+        state = ('link', source_path, source_stat.st_size, source_stat.st_mtime_ns)
+
+        with self.lock:
+            if self.last_written.get(path, None) == state:
+                return False
+
+            temporary_path = OverlayWriter.temporary_path(path)
+
+            try:
+                if os.path.exists(temporary_path):
+                    os.remove(temporary_path)
+
+                try:
+                    os.link(source_path, temporary_path)
+                except OSError:
+                    # -- Different volumes or a file system without hard links.
+                    shutil.copyfile(source_path, temporary_path)
+
+                os.replace(temporary_path, path)
+            except OSError as e:
+                print(f'Error writing {path}: {e}')
+                self.last_written.pop(path, None)
+                return False
+
+            self.last_written[path] = state
+
+        return True
+
+    def remove(self, path):
+        """Remove path unless we already did."""
+
+        state = ('removed',)
+
+        with self.lock:
+            if self.last_written.get(path, None) == state:
+                return False
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f'Error removing {path}: {e}')
+                self.last_written.pop(path, None)
+                return False
+
+            self.last_written[path] = state
+
+        return True
@@ -0,0 +1,181 @@
+#
+# PostQueue
+# Copyright 2021-2022 by Didier Malenfant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import random
+
+from metrics import counter, histogram
+from threading import Condition, Thread
+from time import monotonic, time
+
+SEND_DURATION = histogram('streammanager_post_send_seconds', 'Time it takes to send a post, including its artwork.')
+POST_DELAY = histogram('streammanager_post_delay_seconds', 'Time between a post being queued and it going out.')
+POST_RESULTS = counter('streammanager_post_attempts_total', 'Attempts at sending a post, by result.')
+
+
+# -- Classes
+class PostQueue:
+    """Send posts to a social media client from its own background thread.
+
+    Posts are written to the outbox and callers return right away. They are sent one
+    at a time in the order they were queued so the client's reply thread stays in
+    order. A post that fails is retried with exponential backoff, or once the rate
+    limit resets, until it goes out or the error is one that won't go away.
+    """
+
+    MAX_ATTEMPTS = 10
+    FIRST_RETRY_DELAY = 5
+    MAX_RETRY_DELAY = 15 * 60
+
+    def __init__(self, name, client, outbox, coalescing_window=0):
+        """Initialize the queue and start its worker thread.
+
+        Track posts wait coalescing_window seconds before going out, a newer track
+        queued in the meantime replaces them.
+        """
+
+        self.name = name
+        self.client = client
+        self.outbox = outbox
+        self.coalescing_window = coalescing_window
+        self.condition = Condition()
+        self.posts_changed = False
+        self.stopping = False
+
+        # -- Artwork of the posts queued during this session, so that we don't read it back from the outbox.
+        self.post_artwork = {}
+
+        self.worker = Thread(target=self.process_posts, daemon=True)
+        self.worker.start()
+
+    def post_start_text(self):
+        self.queue_post('start', self.client.stream_start_text)
+
+    def post_stop_text(self):
+        self.queue_post('stop', self.client.stream_stop_text)
+
+    def post_status(self, title, artist, label=None, artwork=None):
+        text = self.client.status_text(title, artist, label)
+        if text is None:
+            return
+
+        self.queue_post('track', text, artwork)
+
+    def queue_post(self, kind, text, artwork=None):
+        post_id = self.outbox.queue_post(self.name, kind, text, artwork, self.coalescing_window)
+
+        with self.condition:
+            if artwork is not None:
+                self.post_artwork[post_id] = artwork
+            else:
+                self.post_artwork.pop(post_id, None)
+
+            self.posts_changed = True
+            self.condition.notify()
+
+    def process_posts(self):
+        while True:
+            post = self.outbox.next_post(self.name)
+
+            with self.condition:
+                delay = None if post is None else post[5] - time()
+
+                if delay is None or delay > 0:
+                    # -- When stopping we only send what is due, the rest waits in the outbox for next time.
+                    if self.stopping:
+                        break
+
+                    if not self.posts_changed:
+                        self.condition.wait(delay)
+
+                    self.posts_changed = False
+                    continue
+
+                post = self.outbox.claim_post(post[0])
+                if post is None:
+                    continue
+
+                artwork = self.post_artwork.pop(post[0], None)
+
+            self.send_post(post, artwork)
+
+    def send_post(self, post, artwork):
+        post_id, kind, text, artwork_digest, attempts, _, created = post
+
+        if artwork is None:
+            artwork = self.outbox.artwork(artwork_digest)
+
+        start_time = monotonic()
+
+        try:
+            remote_id = self.client.send_status(text, in_reply_to=self.outbox.reply_to_id(post_id), artwork=artwork)
+        except Exception as e:
+            SEND_DURATION.observe(monotonic() - start_time, client=self.name, result='error')
+
+            print(f'Error posting to {self.name}!: {text}')
+            print(f'-=> {e}')
+
+            self.schedule_retry(post_id, attempts, artwork, e)
+            return
+
+        SEND_DURATION.observe(monotonic() - start_time, client=self.name, result='sent')
+        POST_DELAY.observe(time() - created, client=self.name, kind=kind)
+        POST_RESULTS.inc(client=self.name, result='sent')
+
+        self.outbox.mark_sent(post_id, remote_id)
+
+    def schedule_retry(self, post_id, attempts, artwork, error):
+        reset_time = self.client.rate_limit_reset_time(error)
+
+        if reset_time is not None:
+            # -- Waiting for a rate limit to reset doesn't count as an attempt.
+            next_attempt = max(reset_time, time() + 1)
+
+            POST_RESULTS.inc(client=self.name, result='rate_limited')
+        else:
+            attempts += 1
+
+            if attempts >= PostQueue.MAX_ATTEMPTS or self.client.is_permanent_error(error):
+                print(f'Giving up on post to {self.name}.')
+                self.outbox.mark_failed(post_id)
+
+                POST_RESULTS.inc(client=self.name, result='failed')
+                return
+
+            POST_RESULTS.inc(client=self.name, result='retried')
+
+            delay = min(PostQueue.FIRST_RETRY_DELAY * 2 ** (attempts - 1), PostQueue.MAX_RETRY_DELAY)
+            next_attempt = time() + delay * random.uniform(0.8, 1.2)
+
+        self.outbox.reschedule(post_id, next_attempt, attempts)
+
+        if artwork is not None:
+            with self.condition:
+                self.post_artwork[post_id] = artwork
+
+    def stop(self):
+        """Stop the worker once the posts that are due are sent."""
+
+        # -- There won't be anything to coalesce with anymore.
+        self.outbox.send_coalesced_posts_now(self.name)
+
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+
+    def wait_until_stopped(self, timeout):
+        self.worker.join(timeout)
@@ -0,0 +1,136 @@
+#
+# Scheduler
+# Copyright 2021-2022 by Didier Malenfant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import heapq
+import math
+
+from metrics import counter, histogram
+from threading import Condition, Thread
+from time import monotonic
+
+LATENESS = histogram('streammanager_scheduled_task_lateness_seconds', 'How late periodic tasks start.')
+SKIPPED_RUNS = counter('streammanager_scheduled_task_skipped_runs_total', 'Runs of periodic tasks skipped because they ran late.')
+
+
+# -- Classes
+class ScheduledTask:
+    """A callback run periodically by a Scheduler."""
+
+    def __init__(self, period, callback, args):
+        """Initialize the task."""
+
+        self.period = period
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    @property
+    def name(self):
+        return getattr(self.callback, '__qualname__', repr(self.callback))
+
+    def cancel(self):
+        """Stop running the task. If it is currently running, this is its last run."""
+
+        self.cancelled = True
+
+    def record_run(self, due_time, now):
+        """Record a run that was due at due_time and return when the next one is due, skipping the ones we missed."""
+
+        LATENESS.observe(now - due_time, task=self.name)
+
+        next_due_time = due_time + self.period
+        if next_due_time <= now:
+            missed_runs = math.floor((now - next_due_time) / self.period) + 1
+
+            SKIPPED_RUNS.inc(missed_runs, task=self.name)
+            next_due_time += missed_runs * self.period
+
+        return next_due_time
+
+
+class Scheduler:
+    """Run all our periodic tasks from a single thread.
+
+    Tasks are due at multiples of their period from when they were scheduled, so they
+    don't drift. A task that runs late skips the runs it missed instead of catching up.
+    """
+
+    def __init__(self):
+        """Initialize the scheduler and start its thread."""
+
+        self.tasks = []
+        self.sequence = 0
+        self.condition = Condition()
+        self.running = True
+        self.thread = Thread(target=self.run, daemon=True)
+
+        self.thread.start()
+
+    def call_every(self, period, callback, *args):
+        """Call callback(*args) every period seconds, starting in period seconds, and return the task."""
+
+        task = ScheduledTask(period, callback, args)
+
+        with self.condition:
+            self.schedule(task, monotonic() + period)
+            self.condition.notify()
+
+        return task
+
+    def schedule(self, task, due_time):
+        # -- The sequence number keeps tasks due at the same time in order, and never compares tasks.
+        heapq.heappush(self.tasks, (due_time, self.sequence, task))
+        self.sequence += 1
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running:
+                    if len(self.tasks) == 0:
+                        self.condition.wait()
+                        continue
+
+                    delay = self.tasks[0][0] - monotonic()
+                    if delay <= 0:
+                        break
+
+                    self.condition.wait(delay)
+
+                if not self.running:
+                    return
+
+                due_time, _, task = heapq.heappop(self.tasks)
+
+                if task.cancelled:
+                    continue
+
+                self.schedule(task, task.record_run(due_time, monotonic()))
+
+            try:
+                task.callback(*task.args)
+            except Exception as e:
+                print(f'Error running {task.name}: {e}')
+
+    def shutdown(self, timeout=1):
+        """Stop running tasks, waiting at most timeout seconds for the one running to finish."""
+
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+        self.thread.join(timeout)
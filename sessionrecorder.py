@@ -0,0 +1,91 @@
+#
+# SessionRecorder
+# Copyright 2021-2022 by Didier Malenfant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import json
+
+from datetime import datetime, timezone
+from queue import Queue
+from threading import Thread
+from time import monotonic
+
+FORMAT_VERSION = 1
+
+
+# -- Functions
+def read_session(path):
+    """Return the header and the list of events of a session file, in the order they were recorded."""
+
+    with open(path, encoding='utf-8') as file:
+        lines = [json.loads(line) for line in file if len(line.strip()) != 0]
+
+    if len(lines) == 0 or lines[0].get('version') != FORMAT_VERSION:
+        raise ValueError(f'{path} is not a session file we can read.')
+
+    return lines[0], lines[1:]
+
+
+# -- Classes
+class SessionRecorder:
+    """Write the events that drive us during a session to a file, so that the session can be replayed.
+
+    Each event is a line of JSON with the time it arrived, in seconds since the start of
+    the recording, where it came from, what it was and its data. The file is written
+    from a background thread so that recording doesn't slow down the event.
+    """
+
+    def __init__(self, path):
+        """Initialize the recorder and start a new session file at path."""
+
+        self.start_time = monotonic()
+        self.file = open(path, 'w', encoding='utf-8')
+        self.events = Queue()
+        self.worker = Thread(target=self.write_events, daemon=True)
+
+        self.write_line({'version': FORMAT_VERSION, 'started': datetime.now(timezone.utc).isoformat()})
+        self.worker.start()
+
+        print(f'Recording session to {path}.')
+
+    def record(self, source, event, data):
+        """Record event from source. data must be something json can write."""
+
+        self.events.put({'time': round(monotonic() - self.start_time, 6), 'source': source, 'event': event, 'data': data})
+
+    def write_events(self):
+        while True:
+            event = self.events.get()
+
+            if event is None:
+                break
+
+            try:
+                self.write_line(event)
+            except (OSError, TypeError, ValueError) as e:
+                print(f'Error recording session event: {e}')
+
+        self.file.close()
+
+    def write_line(self, line):
+        self.file.write(json.dumps(line, ensure_ascii=False) + '\n')
+
+        # -- Flush each event so that the session survives a crash, which is when we need it most.
+        self.file.flush()
+
+    def shutdown(self, timeout=1):
+        self.events.put(None)
+        self.worker.join(timeout)
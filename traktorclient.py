@@ -16,38 +16,48 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import asyncio
 import os
 import xml.etree.ElementTree as xml_tree
 
-from traktor_nowplaying import Listener as TraktorListener
-from mutagen import File as MutagenFile
+from artworkcache import ArtworkCache
+from artworkpayload import ArtworkPayload
+from icecastingest import IcecastIngestServer
+from metrics import histogram
+from overlaywriter import OverlayWriter
+from traktorcollection import CollectionCache, CollectionIndex, hash_file, read_collection
 from pathlib import Path
-from threading import Thread
-from time import sleep
+from threading import Lock, Thread
+from time import monotonic
+from workqueue import WorkQueue
 
-
-# -- Functions
-def call_at_interval(period, callback, args):
-    while True:
-        sleep(period)
-        callback(*args)
+STAGE_DURATION = histogram('streammanager_traktor_stage_seconds', 'Time each stage of handling tracks takes.')
+TRACK_WAIT = histogram('streammanager_traktor_track_wait_seconds', 'Time between Traktor announcing a track and it going on air.')
 
 
-def set_interval(period, callback, *args):
-    Thread(target=call_at_interval, args=(period, callback, args)).start()
+# -- Functions
+def same_file_stat(stat, other_stat):
+    return other_stat is not None and stat.st_size == other_stat.st_size and stat.st_mtime_ns == other_stat.st_mtime_ns
 
 
 # -- Classes
 class TraktorClient:
     """Manage all our Traktor interactions."""
 
-    def __init__(self, config, midi_client, post_clients):
-        """Initialize the client based on user configuration."""
+    def __init__(self, config, midi_client, post_clients, scheduler, rebuild_collection_cache=False, recorder=None,
+                 new_work_queue=WorkQueue):
+        """Initialize the client based on user configuration.
+
+        If recorder is a SessionRecorder, the track info Traktor sends is recorded with it.
+        new_work_queue(name) creates the queue that track info is handled on.
+        """
 
         print('Setting up Traktor...')
 
         self.midi_client = midi_client
         self.post_clients = post_clients
+        self.scheduler = scheduler
+        self.recorder = recorder
         self.playing_track_title_filename = config['OutputTitleFilename']
         self.playing_track_title_prefix = config['OutputTitlePrefix']
         self.playing_track_artist_filename = config['OutputArtistFilename']
@@ -57,6 +67,19 @@ class TraktorClient:
         self.playing_track_artwork_filename = config['OutputArtworkFilename']
         self.no_artwork_placeholder_filename = config['NoArtworkPlaceHolderFilename']
         self.collection_path = Path(config['CollectionFilename'])
+        self.collection_cache = CollectionCache(config.get('CollectionCacheFilename',
+                                                           os.path.expanduser('~/.streammanager_collection.db')))
+        self.rebuild_collection_cache = rebuild_collection_cache
+        self.collection_reload_interval = float(config.get('CollectionReloadInterval', '5'))
+        self.approximate_title_similarity = float(config.get('ApproximateTitleSimilarity',
+                                                             str(CollectionIndex.MIN_SIMILARITY)))
+        self.ingest_ports = [int(port) for port in config.get('IngestPorts', '8000').split(',')]
+        self.ingest_address = config.get('IngestAddress', '') or None
+        self.overlay_writer = OverlayWriter()
+        self.placeholder_artwork_payload = None
+        self.placeholder_artwork_stat = None
+        self.track_artwork_payload = None
+        self.artwork_cache = ArtworkCache(int(config.get('ArtworkCacheSize', '32')))
         self.new_track_available_channel = int(config['NewTrackAvailableChannel']) - 1
         self.new_track_available_note = int(config['NewTrackAvailableNote'])
         self.new_track_available_velocity = int(config['NewTrackAvailableVelocity'])
@@ -70,24 +93,44 @@ class TraktorClient:
         self.next_track_artist_string = None
         self.next_track_label_string = None
         self.next_track_filename = None
+        self.next_track_announced_time = None
         self.current_track_title_string = ''
         self.current_track_artist_string = ''
         self.current_track_label_string = ''
         self.current_track_filename = None
         self.light_on = False
-        self.track_file_collection = {}
+        self.collection = CollectionIndex(min_similarity=self.approximate_title_similarity)
+        self.collection_loaded = False
+        self.track_lock = Lock()
+        self.collection_stat = None
+        self.collection_hash = None
+        self.pending_collection_stat = None
+        self.collection_reloading = False
+
+        # -- Looking tracks up can hit the disk, so track info is handled on a worker and not on the ingest server's event loop.
+        self.meta_updates = new_work_queue('traktor metadata')
 
         midi_client.add_callback(self.new_track_available_channel,
                                  self.new_track_available_note,
-                                 self.new_track_available)
+                                 self.new_track_available, 'traktor')
         midi_client.add_callback(self.clear_current_track_channel,
                                  self.clear_current_track_note,
-                                 self.clear_current_track)
+                                 self.clear_current_track, 'traktor')
         midi_client.add_callback(self.skip_next_track_channel,
                                  self.skip_next_track_note,
-                                 self.skip_next_track)
+                                 self.skip_next_track, 'traktor')
+
+    def queue_meta(self, data):
+        self.meta_updates.put('update_meta', self.update_meta, data)
 
     def update_meta(self, data):
+        if self.recorder is not None:
+            self.recorder.record('traktor', 'update_meta', [list(item) for item in data])
+
+        with STAGE_DURATION.time(stage='update_meta'):
+            self.update_next_track(data)
+
+    def update_next_track(self, data):
         info = dict(data)
         title = info.get("title", "")
         artist = info.get("artist", "")
@@ -95,53 +138,89 @@ class TraktorClient:
         if len(title) == 0 or len(artist) == 0:
             return
 
-        track_string = f'{title}{artist}'
-        self.next_track_title_string = title
-        self.next_track_artist_string = artist
-
         print(f'Available: {title} {artist}')
 
-        track_info = self.track_file_collection.get(track_string, None)
-        if track_info is None:
-            self.next_track_filename = None
-            self.next_track_label_string = ''
-        else:
-            self.next_track_filename = track_info[0]
-            self.next_track_label_string = track_info[1]
+        with self.track_lock:
+            self.next_track_title_string = title
+            self.next_track_artist_string = artist
+            self.next_track_announced_time = monotonic()
+
+            track_info = self.collection.lookup(title, artist)
+            if track_info is None:
+                self.next_track_filename = None
+                self.next_track_label_string = ''
+
+                if not self.collection_loaded:
+                    print('Collection still loading, track info will be filled in later.')
+            else:
+                self.next_track_filename = track_info[0]
+                self.next_track_label_string = track_info[1]
+
+        # -- Start reading the artwork now so that it is ready when the track goes on air.
+        if track_info is not None:
+            self.artwork_cache.prefetch(track_info[0])
+
+    def resolve_tracks_seen_while_loading(self):
+        next_track_filename = None
+        current_track_resolved = False
+
+        with self.track_lock:
+            if self.next_track_title_string and self.next_track_filename is None:
+                track_info = self.collection.lookup(self.next_track_title_string, self.next_track_artist_string)
+                if track_info is not None:
+                    self.next_track_filename = track_info[0]
+                    self.next_track_label_string = track_info[1]
+                    next_track_filename = self.next_track_filename
+
+            if self.current_track_title_string and self.current_track_filename is None:
+                track_info = self.collection.lookup(self.current_track_title_string, self.current_track_artist_string)
+                if track_info is not None:
+                    self.current_track_filename = track_info[0]
+                    self.current_track_label_string = track_info[1]
+                    current_track_resolved = True
+
+        self.artwork_cache.prefetch(next_track_filename)
+
+        if current_track_resolved:
+            # -- The track went on air before we knew about it, complete its overlay.
+            self.update_track_string()
+            self.update_track_artwork()
+
+    def placeholder_artwork(self):
+        try:
+            stat = os.stat(self.no_artwork_placeholder_filename)
+
+            if not same_file_stat(stat, self.placeholder_artwork_stat):
+                self.placeholder_artwork_payload = ArtworkPayload.from_file(self.no_artwork_placeholder_filename)
+                self.placeholder_artwork_stat = stat
+        except OSError as e:
+            print(f'Error reading artwork placeholder: {e}')
+            return None
+
+        return self.placeholder_artwork_payload
 
     def update_track_artwork(self, need_placeholder_artwork=True):
-        artwork = None
-
-        if self.current_track_filename is not None:
-            if os.path.exists(self.current_track_filename):
-                try:
-                    # -- Mutagen can automatically detect format and type of tags
-                    file = MutagenFile(self.current_track_filename)
-
-                    # -- Access APIC frame and grab the image
-                    tag = file.tags.get('APIC:', None)
-
-                    if tag is not None:
-                        artwork = tag.data
-                    else:
-                        cover_list = file.get('covr', None)
-                        if cover_list is not None and len(cover_list):
-                            artwork = cover_list[0]
-                except Exception:
-                    artwork = None
-
-                if artwork is not None:
-                    # -- Write artwork to new image
-                    with open(self.playing_track_artwork_filename, 'wb') as dest_file:
-                        dest_file.write(artwork)
-                        need_placeholder_artwork = False
-
-        if need_placeholder_artwork:
-            with open(self.no_artwork_placeholder_filename, 'rb') as src_file:
-                with open(self.playing_track_artwork_filename, 'wb') as dest_file:
-                    dest_file.write(src_file.read())
-        elif not artwork and os.path.exists(self.playing_track_artwork_filename):
-            os.remove(self.playing_track_artwork_filename)
+        """Update the artwork overlay and return the ArtworkPayload displayed, if any."""
+
+        artwork = self.artwork_cache.get(self.current_track_filename)
+
+        if artwork is not None:
+            # -- Write artwork to new image
+            self.overlay_writer.write_bytes(self.playing_track_artwork_filename, artwork)
+
+            # -- Skipping the next track shows the same artwork again, which we've already identified and hashed.
+            if self.track_artwork_payload is None or self.track_artwork_payload.data is not artwork:
+                self.track_artwork_payload = ArtworkPayload(artwork)
+
+            return self.track_artwork_payload
+        elif need_placeholder_artwork:
+            self.overlay_writer.link_file(self.playing_track_artwork_filename, self.no_artwork_placeholder_filename)
+
+            return self.placeholder_artwork()
+
+        self.overlay_writer.remove(self.playing_track_artwork_filename)
+
+        return None
 
     def update_track_string(self):
         title = self.current_track_title_string
@@ -149,87 +228,156 @@ class TraktorClient:
         if len(title) != 0 and self.playing_track_title_prefix is not None:
             title = self.playing_track_title_prefix + ' ' + title
 
-        Path(self.playing_track_title_filename).write_text(f'{title}')
+        self.overlay_writer.write_text(self.playing_track_title_filename, title)
 
         artist = self.current_track_artist_string
 
         if len(artist) != 0 and self.playing_track_artist_prefix is not None:
             artist = self.playing_track_artist_prefix + ' ' + artist
 
-        Path(self.playing_track_artist_filename).write_text(f'{artist}')
+        self.overlay_writer.write_text(self.playing_track_artist_filename, artist)
 
         label = self.current_track_label_string
 
         if len(label) != 0 and self.playing_track_label_prefix is not None:
             label = self.playing_track_label_prefix + ' ' + label
 
-        Path(self.playing_track_label_filename).write_text(f'{label}')
+        self.overlay_writer.write_text(self.playing_track_label_filename, label)
 
         print(f'Output: {title} {artist} {label}')
 
     def parse_collection(self):
-        print('Parsing Traktor collection...')
+        stat = os.stat(self.collection_path)
+        cached_collection = None
 
-        xml_root = xml_tree.ElementTree(file=self.collection_path).getroot()
+        if not self.rebuild_collection_cache:
+            cached_collection = self.collection_cache.load(self.collection_path)
 
-        for collection in xml_root.findall('COLLECTION'):
-            for entry in collection.findall('ENTRY'):
-                location = entry.find('LOCATION')
+        if cached_collection is None:
+            print('Parsing Traktor collection...')
 
-                if location is None:
-                    continue
+            # -- Stat and hash before parsing so that a collection modified while we parse it
+            # -- is seen as stale the next time we check it.
+            stat = os.stat(self.collection_path)
+            content_hash = hash_file(self.collection_path)
 
-                volume = location.get('VOLUME')
+            tracks = read_collection(self.collection_path)
 
-                if volume is None:
-                    continue
+            self.collection_cache.save(self.collection_path, tracks, stat, content_hash)
+        else:
+            print('Loaded Traktor collection from cache.')
 
-                directory = location.get('DIR')
+            tracks, content_hash = cached_collection
 
-                if directory is None:
-                    continue
+        self.collection = CollectionIndex(tracks, self.approximate_title_similarity)
+        self.collection_stat = stat
+        self.collection_hash = content_hash
 
-                file = location.get('FILE')
+    def reload_collection(self, stat):
+        content_hash = hash_file(self.collection_path)
 
-                if file is None:
-                    continue
+        if content_hash != self.collection_hash:
+            try:
+                tracks = read_collection(self.collection_path)
+            except xml_tree.ParseError as e:
+                print(f'Error reloading Traktor collection: {e}')
 
-                filename = '/Volumes/' + volume + \
-                    directory.replace('/:', '/') + file
+                # -- Wait for the next change before trying again.
+                self.collection_stat = stat
+                return
 
-                title = entry.get('TITLE')
+            added, changed, removed = self.collection.diff(tracks)
 
-                if title is None:
-                    continue
+            # -- Lookups keep using the previous index until this assignment swaps the new one in.
+            self.collection = self.collection.updated(added, changed, removed)
 
-                artist = entry.get('ARTIST')
+            self.collection_cache.save(self.collection_path, tracks, stat, content_hash,
+                                       changes=(added, changed, removed), previous_hash=self.collection_hash)
 
-                if artist is None:
-                    continue
+            print(f'Reloaded Traktor collection: {len(added)} added, {len(changed)} changed, {len(removed)} removed.')
 
-                key = f'{title}{artist}'
+        self.collection_stat = stat
+        self.collection_hash = content_hash
 
-                label = ''
-                info = entry.find('INFO')
+    def check_for_collection_changes(self):
+        try:
+            stat = os.stat(self.collection_path)
+        except OSError:
+            return
 
-                if info is not None:
-                    found_label = info.get('LABEL')
+        if same_file_stat(stat, self.collection_stat):
+            self.pending_collection_stat = None
+            return
 
-                    if found_label is not None:
-                        label = found_label
+        # -- Traktor rewrites the whole file when it saves, so we wait for it to stop changing before reading it.
+        if self.pending_collection_stat is None or not same_file_stat(stat, self.pending_collection_stat):
+            self.pending_collection_stat = stat
+            return
+
+        self.pending_collection_stat = None
+
+        # -- Reloading takes a while, don't hold up the other periodic tasks.
+        if not self.collection_reloading:
+            self.collection_reloading = True
+            Thread(target=self.reload_collection_in_background, args=(stat,), daemon=True).start()
+
+    def reload_collection_in_background(self, stat):
+        try:
+            if not self.collection_loaded:
+                # -- The collection couldn't be loaded at startup, it may have been created or fixed since.
+                self.load_collection(stat)
+                return
+
+            with STAGE_DURATION.time(stage='reload_collection'):
+                self.reload_collection(stat)
+        except OSError as e:
+            print(f'Error reloading Traktor collection: {e}')
+        finally:
+            self.collection_reloading = False
+
+    def load_collection(self, stat=None):
+        """Load the collection for the first time. stat is the file's, if we know it."""
+
+        try:
+            with STAGE_DURATION.time(stage='load_collection'):
+                self.parse_collection()
+        except (OSError, xml_tree.ParseError) as e:
+            print(f'Error loading Traktor collection: {e}')
+
+            # -- Wait for the next change before trying again.
+            self.collection_stat = stat
+            return
 
-                if key not in self.track_file_collection:
-                    self.track_file_collection[key] = [filename, label]
+        self.collection_loaded = True
+        self.resolve_tracks_seen_while_loading()
+
+        print(f'Traktor collection ready ({len(self.collection)} tracks).')
+
+    def load_and_watch_collection(self):
+        self.load_collection()
+
+        # -- If loading failed, watching is how we get another chance.
+        if self.collection_reload_interval > 0:
+            self.scheduler.call_every(self.collection_reload_interval, self.check_for_collection_changes)
 
     def start(self):
-        self.parse_collection()
+        """Listen to Traktor on an event loop of our own, until interrupted."""
+
+        asyncio.run(self.listen())
 
-        set_interval(1, self.check_for_new_tracks)
+    async def listen(self):
+        """Listen to Traktor on the running event loop, until cancelled."""
 
-        print('Listening to Traktor...')
-        listener = TraktorListener(port=8000, quiet=True, custom_callback=self.update_meta)
+        self.start_background_tasks()
 
-        listener.start()
+        # -- B2B sets have each laptop broadcast to its own port, and they all feed the same track info.
+        await IcecastIngestServer(self.ingest_ports, self.queue_meta, self.ingest_address).serve_forever()
+
+    def start_background_tasks(self):
+        # -- Load the collection in the background so that we don't miss anything Traktor broadcasts in the meantime.
+        Thread(target=self.load_and_watch_collection, daemon=True).start()
+
+        self.scheduler.call_every(1, self.check_for_new_tracks)
 
     def check_for_new_tracks(self):
         if self.next_track_title_string is not None:
@@ -253,58 +401,77 @@ class TraktorClient:
                                       self.skip_next_track_channel)
 
     def new_track_available(self, channel, note):
-        if self.next_track_title_string is None:
-            return
+        with self.track_lock:
+            if self.next_track_title_string is None:
+                return
 
-        self.current_track_title_string = self.next_track_title_string
-        self.next_track_title_string = None
+            self.current_track_title_string = self.next_track_title_string
+            self.next_track_title_string = None
 
-        self.current_track_artist_string = self.next_track_artist_string
-        self.next_track_artist_string = None
+            self.current_track_artist_string = self.next_track_artist_string
+            self.next_track_artist_string = None
 
-        self.current_track_label_string = self.next_track_label_string
-        self.next_track_label_string = None
+            self.current_track_label_string = self.next_track_label_string
+            self.next_track_label_string = None
 
-        self.current_track_filename = self.next_track_filename
-        self.next_track_filename = None
+            self.current_track_filename = self.next_track_filename
+            self.next_track_filename = None
 
-        self.update_track_string()
-        self.update_track_artwork()
+            announced_time = self.next_track_announced_time
+            self.next_track_announced_time = None
 
-        for client in self.post_clients:
-            client.post_status(self.current_track_title_string,
-                               self.current_track_artist_string,
-                               self.current_track_label_string,
-                               self.playing_track_artwork_filename)
+        if announced_time is not None:
+            TRACK_WAIT.observe(monotonic() - announced_time)
+
+        with STAGE_DURATION.time(stage='overlay_text'):
+            self.update_track_string()
+
+        with STAGE_DURATION.time(stage='overlay_artwork'):
+            artwork = self.update_track_artwork()
+
+        with STAGE_DURATION.time(stage='queue_posts'):
+            for client in self.post_clients:
+                client.post_status(self.current_track_title_string,
+                                   self.current_track_artist_string,
+                                   self.current_track_label_string,
+                                   artwork)
 
     def clear_current_track(self, channel, note):
         print('Clearing Track Name')
 
-        self.next_track_title_string = ''
-        self.current_track_title_string = self.next_track_title_string
+        with self.track_lock:
+            self.next_track_title_string = ''
+            self.current_track_title_string = self.next_track_title_string
 
-        self.next_track_artist_string = ''
-        self.current_track_artist_string = self.next_track_artist_string
+            self.next_track_artist_string = ''
+            self.current_track_artist_string = self.next_track_artist_string
 
-        self.next_track_label_string = ''
-        self.current_track_label_string = self.next_track_label_string
+            self.next_track_label_string = ''
+            self.current_track_label_string = self.next_track_label_string
 
-        self.next_track_filename = None
-        self.current_track_filename = self.next_track_filename
+            self.next_track_filename = None
+            self.next_track_announced_time = None
+            self.current_track_filename = self.next_track_filename
 
         self.update_track_string()
         self.update_track_artwork(False)
 
     def skip_next_track(self, channel, note):
-        if self.next_track_title_string is None:
-            return
+        with self.track_lock:
+            if self.next_track_title_string is None:
+                return
 
-        print('Skipping Next Track')
+            print('Skipping Next Track')
 
-        self.next_track_title_string = None
-        self.next_track_artist_string = None
-        self.next_track_label_string = None
-        self.next_track_filename = None
+            self.next_track_title_string = None
+            self.next_track_artist_string = None
+            self.next_track_label_string = None
+            self.next_track_filename = None
+            self.next_track_announced_time = None
 
         self.update_track_string()
         self.update_track_artwork()
+
+    def shutdown(self):
+        self.meta_updates.stop()
+        self.meta_updates.wait_until_stopped(1)
@@ -0,0 +1,535 @@
+#
+# TraktorCollection
+# Copyright 2021-2022 by Didier Malenfant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import functools
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+import unicodedata
+import xml.etree.ElementTree as xml_tree
+
+# -- Featured artists are written differently in the NML and in the stream metadata so we ignore them.
+FEATURING_IN_BRACKETS = re.compile(r'[\(\[]\s*(?:feat|ft|featuring)\b[^\)\]]*[\)\]]')
+FEATURING_AT_END = re.compile(r'(?<=\S)\s+(?:feat|ft|featuring)\b')
+# -- A credit needs a title or an artist before it, 'The Ft. Lauderdale Sessions' doesn't have one.
+ARTICLES = ('the', 'a', 'an')
+NON_WORD_CHARACTERS = re.compile(r'[\W_]+')
+COMBINING_MARKS = re.compile('[\u0300-\u036f\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff\ufe20-\ufe2f]')
+
+
+# -- Functions
+def parse_collection_entry(entry):
+    """Return (filename, title, artist, label) for an ENTRY element or None if it is incomplete."""
+
+    location = entry.find('LOCATION')
+
+    if location is None:
+        return None
+
+    volume = location.get('VOLUME')
+
+    if volume is None:
+        return None
+
+    directory = location.get('DIR')
+
+    if directory is None:
+        return None
+
+    file = location.get('FILE')
+
+    if file is None:
+        return None
+
+    filename = '/Volumes/' + volume + \
+        directory.replace('/:', '/') + file
+
+    title = entry.get('TITLE')
+
+    if title is None:
+        return None
+
+    artist = entry.get('ARTIST')
+
+    if artist is None:
+        return None
+
+    label = ''
+    info = entry.find('INFO')
+
+    if info is not None:
+        found_label = info.get('LABEL')
+
+        if found_label is not None:
+            label = found_label
+
+    return (filename, title, artist, label)
+
+
+def iter_collection_entries(collection_path):
+    """Yield (filename, title, artist, label) for each track in a collection.nml file."""
+
+    # -- We stream the file instead of building the whole tree so that memory use
+    # -- stays flat no matter how big the collection is. Elements are removed from
+    # -- their parent as soon as they are closed, except for the children of an
+    # -- NML/COLLECTION/ENTRY which we need until the entry itself is closed.
+    path = []
+    for event, element in xml_tree.iterparse(collection_path, events=('start', 'end')):
+        if event == 'start':
+            path.append(element)
+            continue
+
+        path.pop()
+
+        depth = len(path)
+        if depth > 2 and path[2].tag == 'ENTRY' and path[1].tag == 'COLLECTION':
+            continue
+
+        if depth == 2 and element.tag == 'ENTRY' and path[1].tag == 'COLLECTION':
+            track = parse_collection_entry(element)
+            if track is not None:
+                yield track
+
+        if depth != 0:
+            path[-1].remove(element)
+
+
+def read_collection(collection_path):
+    """Return a dictionary of filename -> (title, artist, label) for a collection.nml file."""
+
+    tracks = {}
+
+    for filename, title, artist, label in iter_collection_entries(collection_path):
+        tracks[filename] = (title, artist, label)
+
+    return tracks
+
+
+@functools.lru_cache(maxsize=65536)
+def normalize_text(text):
+    """Return text without case, accents, punctuation, extra whitespace or featured artists.
+
+    Text that would be left with nothing, like '!!!', only loses its case and extra whitespace.
+    """
+
+    original_text = text
+
+    if not text.isascii():
+        text = COMBINING_MARKS.sub('', unicodedata.normalize('NFKD', text))
+
+    text = text.casefold()
+
+    if 'f' in text:
+        text = FEATURING_IN_BRACKETS.sub(' ', text)
+
+        for match in FEATURING_AT_END.finditer(text):
+            if NON_WORD_CHARACTERS.sub(' ', text[:match.start()]).strip() not in ARTICLES:
+                text = text[:match.start()]
+                break
+
+    text = NON_WORD_CHARACTERS.sub(' ', text).strip()
+
+    if len(text) == 0:
+        # -- Names made only of punctuation would all end up the same otherwise.
+        return ' '.join(original_text.casefold().split())
+
+    return text
+
+
+def hash_file(file_path):
+    digest = hashlib.sha256()
+
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+# -- Classes
+class ShardedDict:
+    """Dictionary split in shards by key hash.
+
+    A copy shares its shards with the original and a shard is only copied the first
+    time either of them changes it, so a copy with a few changes costs about as much
+    as the changes do.
+    """
+
+    SHARD_COUNT = 256
+
+    def __init__(self, items=()):
+        """Initialize the dictionary with (key, value) items."""
+
+        self.shards = [{} for _ in range(ShardedDict.SHARD_COUNT)]
+        self.owned_shards = set(range(ShardedDict.SHARD_COUNT))
+
+        for key, value in items:
+            self.shards[hash(key) % ShardedDict.SHARD_COUNT][key] = value
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def __contains__(self, key):
+        return key in self.shards[hash(key) % ShardedDict.SHARD_COUNT]
+
+    def __getitem__(self, key):
+        return self.shards[hash(key) % ShardedDict.SHARD_COUNT][key]
+
+    def __setitem__(self, key, value):
+        self.writable_shard(key)[key] = value
+
+    def __delitem__(self, key):
+        del self.writable_shard(key)[key]
+
+    def get(self, key, default=None):
+        return self.shards[hash(key) % ShardedDict.SHARD_COUNT].get(key, default)
+
+    def pop(self, key):
+        return self.writable_shard(key).pop(key)
+
+    def keys(self):
+        for shard in self.shards:
+            yield from shard
+
+    def items(self):
+        for shard in self.shards:
+            yield from shard.items()
+
+    def copy(self):
+        copy = ShardedDict()
+        copy.shards = list(self.shards)
+        copy.owned_shards = set()
+
+        # -- Our shards are shared now, we can't change them in place anymore either.
+        self.owned_shards = set()
+
+        return copy
+
+    def writable_shard(self, key):
+        index = hash(key) % ShardedDict.SHARD_COUNT
+
+        if index not in self.owned_shards:
+            self.shards[index] = dict(self.shards[index])
+            self.owned_shards.add(index)
+
+        return self.shards[index]
+
+
+class CollectionIndex:
+    """Lookup table from title and artist to track file and label.
+
+    An index is never modified once built, updates return a new index so that readers
+    on other threads always see a complete one.
+    """
+
+    # -- Default minimum Dice similarity between the title tokens of two keys for an approximate match.
+    MIN_SIMILARITY = 0.8
+
+    def __init__(self, tracks=None, min_similarity=MIN_SIMILARITY):
+        """Initialize the index with a dictionary of filename -> (title, artist, label).
+
+        A title that isn't found as is can still match a title by the same artist with a
+        similarity of at least min_similarity. 0 disables those approximate matches.
+        """
+
+        tracks = {} if tracks is None else tracks
+        candidates_by_key = {}
+        tokens_by_key = {}
+        keys_by_artist = {}
+
+        for filename, track in tracks.items():
+            key = CollectionIndex.key(track)
+            candidates = candidates_by_key.get(key, None)
+
+            if candidates is None:
+                candidates_by_key[key] = [filename]
+
+                tokens_by_key[key] = CollectionIndex.tokens(key)
+                keys_by_artist.setdefault(key[1], []).append(key)
+            else:
+                candidates.append(filename)
+
+        self.min_similarity = min_similarity
+        self.tracks = ShardedDict(tracks.items())
+        self.candidates = ShardedDict(candidates_by_key.items())
+        self.tokens_by_key = ShardedDict(tokens_by_key.items())
+        self.keys_by_artist = ShardedDict(keys_by_artist.items())
+
+    def __len__(self):
+        return len(self.tracks)
+
+    @staticmethod
+    def key(track):
+        return (normalize_text(track[0]), normalize_text(track[1]))
+
+    @staticmethod
+    def tokens(key):
+        """Return the distinct words in the title of key, interned since most of them are in many keys."""
+
+        return tuple({sys.intern(token) for token in key[0].split()})
+
+    def lookup(self, title, artist):
+        """Return (filename, label) for a track or None if it is not in the collection."""
+
+        key = CollectionIndex.key((title, artist))
+
+        candidates = self.candidates.get(key, None)
+        if candidates is None:
+            candidates = self.approximate_candidates(key)
+
+            if candidates is None:
+                return None
+
+        filename = candidates[0]
+
+        # -- The same track can be in the collection more than once, prefer a copy we can read.
+        if len(candidates) > 1:
+            for candidate in candidates:
+                if os.path.exists(candidate):
+                    filename = candidate
+                    break
+
+        return (filename, self.tracks[filename][2])
+
+    def approximate_candidates(self, key):
+        """Return the candidates for the key by the same artist with the title most similar to the one in key."""
+
+        if not 0 < self.min_similarity <= 1:
+            return None
+
+        # -- A similar title by another artist is another track, so only the artist's own titles are compared.
+        artist_keys = self.keys_by_artist.get(key[1], None)
+        if artist_keys is None:
+            return None
+
+        query_tokens = frozenset(CollectionIndex.tokens(key))
+        query_token_count = len(query_tokens)
+        if query_token_count == 0:
+            return None
+
+        best_key = None
+        best_similarity = self.min_similarity
+
+        for candidate_key in artist_keys:
+            candidate_tokens = self.tokens_by_key[candidate_key]
+            candidate_token_count = len(candidate_tokens)
+
+            # -- Titles with too few or too many words can't be similar enough, whatever words they share.
+            if 2 * min(query_token_count, candidate_token_count) < best_similarity * (query_token_count + candidate_token_count):
+                continue
+
+            similarity = 2 * len(query_tokens.intersection(candidate_tokens)) / (query_token_count + candidate_token_count)
+
+            if similarity >= best_similarity:
+                best_key = candidate_key
+                best_similarity = similarity
+
+        if best_key is None:
+            return None
+
+        return self.candidates[best_key]
+
+    def diff(self, tracks):
+        """Return the (added, changed, removed) tracks needed to go from this index to tracks."""
+
+        added = {}
+        changed = {}
+
+        for filename, track in tracks.items():
+            existing_track = self.tracks.get(filename, None)
+
+            if existing_track is None:
+                added[filename] = track
+            elif existing_track != track:
+                changed[filename] = track
+
+        # -- Every track that is neither added nor kept was removed.
+        removed = set()
+        if len(self.tracks) + len(added) != len(tracks):
+            removed = {filename for filename in self.tracks.keys() if filename not in tracks}
+
+        return added, changed, removed
+
+    def updated(self, added, changed, removed):
+        """Return a new index with the given changes applied.
+
+        The new index shares the shards of our lookup tables that the changes don't touch,
+        so this takes time proportional to the changes and not to the size of the collection.
+        """
+
+        index = CollectionIndex(min_similarity=self.min_similarity)
+        index.tracks = self.tracks.copy()
+        index.candidates = self.candidates.copy()
+        index.tokens_by_key = self.tokens_by_key.copy()
+        index.keys_by_artist = self.keys_by_artist.copy()
+
+        for filename in removed:
+            index.remove_candidate(filename, index.tracks.pop(filename))
+
+        for filename, track in changed.items():
+            previous_track = index.tracks[filename]
+            index.tracks[filename] = track
+
+            if CollectionIndex.key(previous_track) != CollectionIndex.key(track):
+                index.remove_candidate(filename, previous_track)
+                index.add_candidate(filename, track)
+
+        for filename, track in added.items():
+            index.tracks[filename] = track
+            index.add_candidate(filename, track)
+
+        return index
+
+    # -- Lists can be shared with the index we were copied from so we never modify them in place.
+    def add_candidate(self, filename, track):
+        key = CollectionIndex.key(track)
+        candidates = self.candidates.get(key, None)
+
+        if candidates is None:
+            self.candidates[key] = [filename]
+            self.tokens_by_key[key] = CollectionIndex.tokens(key)
+            self.keys_by_artist[key[1]] = self.keys_by_artist.get(key[1], []) + [key]
+        else:
+            self.candidates[key] = candidates + [filename]
+
+    def remove_candidate(self, filename, track):
+        key = CollectionIndex.key(track)
+        remaining = [candidate for candidate in self.candidates[key] if candidate != filename]
+
+        if len(remaining):
+            self.candidates[key] = remaining
+            return
+
+        del self.candidates[key]
+        del self.tokens_by_key[key]
+
+        remaining_keys = [other_key for other_key in self.keys_by_artist[key[1]] if other_key != key]
+
+        if len(remaining_keys):
+            self.keys_by_artist[key[1]] = remaining_keys
+        else:
+            del self.keys_by_artist[key[1]]
+
+
+class CollectionCache:
+    """Persistent index of a parsed collection.nml, stored in an SQLite database."""
+
+    SCHEMA_VERSION = '2'
+    TRACKS_TABLE = 'CREATE TABLE IF NOT EXISTS tracks (filename TEXT PRIMARY KEY, title TEXT, artist TEXT, label TEXT)'
+
+    def __init__(self, cache_path):
+        """Initialize the cache stored at cache_path."""
+
+        self.cache_path = cache_path
+
+    def connect(self):
+        connection = sqlite3.connect(self.cache_path)
+        connection.execute('CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT)')
+        connection.execute(CollectionCache.TRACKS_TABLE)
+
+        return connection
+
+    def load(self, collection_path):
+        """Return (tracks, content_hash) for collection_path or None if the cache is missing or stale."""
+
+        if not os.path.exists(self.cache_path):
+            return None
+
+        try:
+            stat = os.stat(collection_path)
+
+            connection = self.connect()
+            try:
+                info = dict(connection.execute('SELECT key, value FROM info'))
+
+                if info.get('schema') != CollectionCache.SCHEMA_VERSION or \
+                   info.get('path') != str(os.path.abspath(collection_path)) or \
+                   info.get('size') != str(stat.st_size):
+                    return None
+
+                content_hash = info.get('hash')
+
+                if info.get('mtime') != str(stat.st_mtime_ns):
+                    # -- The file was touched, only the content hash can tell us if it really changed.
+                    if content_hash != hash_file(collection_path):
+                        return None
+
+                    with connection:
+                        connection.execute('UPDATE info SET value = ? WHERE key = ?', (str(stat.st_mtime_ns), 'mtime'))
+
+                tracks = {}
+                for filename, title, artist, label in connection.execute('SELECT * FROM tracks ORDER BY rowid'):
+                    tracks[filename] = (title, artist, label)
+
+                return tracks, content_hash
+            finally:
+                connection.close()
+        except (OSError, sqlite3.Error) as e:
+            print(f'Error reading collection cache: {e}')
+            return None
+
+    def save(self, collection_path, tracks, stat, content_hash, changes=None, previous_hash=None):
+        """Store the tracks parsed from collection_path.
+
+        If changes is an (added, changed, removed) tuple only those tracks are written
+        instead of replacing the whole table, as long as the cache still holds the
+        collection with previous_hash those changes were made from.
+        """
+
+        try:
+            info = {
+                'schema': CollectionCache.SCHEMA_VERSION,
+                'path': str(os.path.abspath(collection_path)),
+                'size': str(stat.st_size),
+                'mtime': str(stat.st_mtime_ns),
+                'hash': content_hash
+            }
+
+            connection = self.connect()
+            try:
+                with connection:
+                    if changes is not None:
+                        # -- An earlier save may have failed, in which case the changes aren't enough to catch up.
+                        stored_hash = connection.execute('SELECT value FROM info WHERE key = ?', ('hash',)).fetchone()
+                        if stored_hash is None or stored_hash[0] != previous_hash:
+                            changes = None
+
+                    connection.execute('DELETE FROM info')
+
+                    if changes is None:
+                        # -- Recreate the table in case it was created by an older version of the schema.
+                        connection.execute('DROP TABLE tracks')
+                        connection.execute(CollectionCache.TRACKS_TABLE)
+                        rows = tracks.items()
+                    else:
+                        added, changed, removed = changes
+                        connection.executemany('DELETE FROM tracks WHERE filename = ?',
+                                               ((filename,) for filename in removed))
+                        rows = list(added.items()) + list(changed.items())
+
+                    # -- Upsert instead of replace so that rows keep their position in the collection.
+                    connection.executemany('INSERT INTO tracks VALUES (?, ?, ?, ?) ON CONFLICT(filename) DO UPDATE '
+                                           'SET title = excluded.title, artist = excluded.artist, label = excluded.label',
+                                           ((filename,) + track for filename, track in rows))
+                    connection.executemany('INSERT INTO info VALUES (?, ?)', info.items())
+            finally:
+                connection.close()
+        except (OSError, sqlite3.Error) as e:
+            print(f'Error writing collection cache: {e}')
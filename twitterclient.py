@@ -22,9 +22,11 @@
 #                          consumer_secret=self.consumer_secret, access_token=self.access_token,
 #                          access_token_secret=self.access_token_secret)
 
-import os
+import io
 import tweepy
 
+from mediacache import MediaCache
+
 
 # -- Classes
 class TwitterClient:
@@ -44,13 +46,17 @@ class TwitterClient:
         self.stream_stop_text = posts['StreamStopText']
         self.track_update_text = posts['TrackUpdateText']
         self.track_update_no_label_text = posts['TrackUpdateNoLabelText']
-        self.last_tweet_status_id = None
+
+        # -- Twitter media IDs can be attached to other tweets until they expire (24 hours by default).
+        self.media_cache = MediaCache(24 * 60 * 60)
 
         auth = tweepy.OAuthHandler(self.consumer_key, self.consumer_secret)
         auth.set_access_token(self.access_token, self.access_token_secret)
-        self.api = tweepy.API(auth)
+        # -- The hosts can be changed to test against a stand-in, like benchmarks/fake_social_server.py.
+        self.api = tweepy.API(auth, host=config.get('APIHost', 'api.twitter.com'),
+                              upload_host=config.get('UploadHost', 'upload.twitter.com'))
 
-    def tweet(self, text, in_reply_to=None, media_filename=None):
+    def send_status(self, text, in_reply_to=None, artwork=None):
         """Tweet some text.
 
         Parameters
@@ -59,57 +65,70 @@ class TwitterClient:
             Text of the status to post.
         in_reply_to : Optional[str]
             Optional status ID of a tweet to reply to.
-        media_filename : Optional[str]
-            Optional filename of an image to post as media.
+        artwork : Optional[ArtworkPayload]
+            Optional image to post as media.
 
         Returns
         -------
         str
-            Status ID of the tweet posted or None if something went wrong.
-        """
+            Status ID of the tweet posted.
 
-        if self.api is None:
-            return None
+        Raises
+        ------
+        Exception
+            Whatever tweepy raised if the tweet could not be posted.
+        """
 
-        result = None
         media_ids = None
+        using_cached_media = False
+
+        if artwork is not None:
+            media_id = self.media_cache.get(artwork.digest)
+            using_cached_media = media_id is not None
+
+            if not using_cached_media:
+                media_id = self.upload_media(artwork)
+
+            media_ids = [media_id]
 
-        # -- Update the status
         try:
-            if media_filename is not None and os.path.exists(media_filename):
-                # -- Posting media requires elevated Twitter API access (because it uses V1 api)
-                file = open(media_filename, 'rb')
-                media = self.api.media_upload(filename=media_filename, file=file)
-                file.close()
+            result = self.api.update_status(status=text,
+                                            in_reply_to_status_id=in_reply_to,
+                                            media_ids=media_ids)
+        except tweepy.errors.TooManyRequests:
+            raise
+        except Exception:
+            if not using_cached_media:
+                raise
 
-                media_ids = [media.media_id_string]
+            # -- The media we uploaded earlier may not be valid anymore, upload it again.
+            self.media_cache.remove(artwork.digest)
+            media_ids = [self.upload_media(artwork)]
 
             result = self.api.update_status(status=text,
                                             in_reply_to_status_id=in_reply_to,
                                             media_ids=media_ids)
 
-            print(f'Tweet!: {text}')
-        except Exception as e:
-            print(f'Error tweeting!: {text}')
-            print(f'-=> {e}')
-            return None
+        print(f'Tweet!: {text}')
 
         return result.id_str
 
-    def post_start_text(self):
-        """Tweet the stream start text."""
-        self.last_tweet_status_id = self.tweet(self.stream_start_text)
+    def upload_media(self, artwork):
+        # -- Posting media requires elevated Twitter API access (because it uses V1 api)
+        # -- Tweepy guesses the media type from the filename so we give it one with the right extension.
+        media = self.api.media_upload(filename=f'artwork{artwork.extension}', file=io.BytesIO(artwork.data))
+
+        # -- Keep a safety margin so that we never attach media that is about to expire.
+        lifetime = int(getattr(media, 'expires_after_secs', self.media_cache.lifetime)) - 60 * 60
+        self.media_cache.add(artwork.digest, media.media_id_string, lifetime)
 
-    def post_stop_text(self):
-        """Tweet the stream stop text."""
-        self.tweet(self.stream_stop_text, in_reply_to=self.last_tweet_status_id)
-        self.last_tweet_status_id = None
+        return media.media_id_string
 
-    def post_status(self, title, artist, label=None, artwork_filename=None):
-        """Tweet the currently playing track."""
+    def status_text(self, title, artist, label=None):
+        """Return the text of the status for a track or None if there is nothing to post."""
 
         if len(title) == 0 or len(artist) == 0:
-            return
+            return None
 
         if label is None or len(label) == 0:
             update_message = self.track_update_no_label_text.replace('{title}', title)
@@ -119,6 +138,22 @@ class TwitterClient:
             update_message = update_message.replace('{artist}', artist)
             update_message = update_message.replace('{label}', label)
 
-        self.last_tweet_status_id = self.tweet(text=update_message,
-                                               media_filename=artwork_filename,
-                                               in_reply_to=self.last_tweet_status_id)
+        return update_message
+
+    @staticmethod
+    def is_permanent_error(error):
+        """Return True if posting again would fail the same way."""
+
+        return isinstance(error, (tweepy.errors.BadRequest, tweepy.errors.Unauthorized,
+                                  tweepy.errors.Forbidden, tweepy.errors.NotFound))
+
+    @staticmethod
+    def rate_limit_reset_time(error):
+        """Return the time at which we can post again if error is a rate limit, None otherwise."""
+
+        if not isinstance(error, tweepy.errors.TooManyRequests):
+            return None
+
+        reset_time = error.response.headers.get('x-rate-limit-reset', None)
+
+        return None if reset_time is None else float(reset_time)
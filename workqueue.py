@@ -0,0 +1,73 @@
+#
+# WorkQueue
+# Copyright 2021-2022 by Didier Malenfant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from metrics import histogram
+from queue import Queue
+from threading import Thread
+from time import monotonic
+
+QUEUE_LATENCY = histogram('streammanager_work_queue_latency_seconds', 'Time between work arriving and its callback starting.')
+WORK_DURATION = histogram('streammanager_work_duration_seconds', 'Time callbacks from work queues take to run.')
+
+
+# -- Classes
+class WorkQueue:
+    """Run callbacks one at a time, in order, on a background thread.
+
+    Each callback is queued with a label and we keep track of how long callbacks with
+    that label wait between being queued and starting to run, and how long they run.
+    """
+
+    def __init__(self, name):
+        """Initialize the queue and start its worker thread."""
+
+        self.name = name
+        self.work = Queue()
+        self.worker = Thread(target=self.process_work, daemon=True)
+
+        self.worker.start()
+
+    def put(self, label, callback, *args, queued_time=None):
+        """Queue callback(*args). queued_time is when the work arrived, if it was before now."""
+
+        self.work.put((label, callback, args, monotonic() if queued_time is None else queued_time))
+
+    def process_work(self):
+        while True:
+            label, callback, args, queued_time = self.work.get()
+
+            if callback is None:
+                break
+
+            start_time = monotonic()
+            QUEUE_LATENCY.observe(start_time - queued_time, queue=self.name, work=label)
+
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f'Error running {label}: {e}')
+
+            WORK_DURATION.observe(monotonic() - start_time, queue=self.name, work=label)
+
+    def stop(self):
+        """Stop the worker once the work already queued is done."""
+
+        self.work.put((None, None, (), 0))
+
+    def wait_until_stopped(self, timeout):
+        self.worker.join(timeout)